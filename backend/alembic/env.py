@@ -0,0 +1,51 @@
+"""
+Alembic environment.
+
+Migrations run against DATABASE_URL by default. Pass `-x shard=<name>` to run
+them against one of the TRANSACTION_SHARD_URLS databases (which only hold
+qris_transactions), or `-x url=<url>` for any other database.
+
+Every migration checks the live schema before changing it, so databases that
+create_all already brought up to date can simply be upgraded as well. For the
+same reason offline (--sql) mode isn't supported.
+"""
+from logging.config import fileConfig
+
+from sqlalchemy import create_engine, pool
+
+from alembic import context
+
+from app import models
+from app.database import DATABASE_URL
+from app.sharding import shard_urls
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+def _target_url() -> str:
+    arguments = context.get_x_argument(as_dictionary=True)
+    shard = arguments.get("shard")
+    config.attributes["transaction_shard"] = shard is not None
+    if shard is not None:
+        if shard not in shard_urls:
+            raise ValueError(f"Shard {shard!r} is not configured in TRANSACTION_SHARD_URLS")
+        return shard_urls[shard]
+    return arguments.get("url", DATABASE_URL)
+
+def run_migrations_online() -> None:
+    """Run the migrations against the target database."""
+    connectable = create_engine(_target_url(), poolclass=pool.NullPool)
+
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    raise RuntimeError("Migrations inspect the live schema; run them online")
+run_migrations_online()
@@ -0,0 +1,63 @@
+"""Baseline schema, as created by create_all before migrations were added
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+Existing databases already have these tables and are left as they are.
+Transaction shards get their tables from `python -m app.sharding init`.
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if context.config.attributes.get("transaction_shard"):
+        return
+    inspector = sa.inspect(op.get_bind())
+
+    if not inspector.has_table("merchants"):
+        op.create_table(
+            "merchants",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(255), nullable=False),
+            sa.Column("merchant_id", sa.String(255), nullable=False),
+            sa.Column("api_key_encrypted", sa.Text(), nullable=False),
+            sa.Column("is_active", sa.Boolean()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_merchants_id", "merchants", ["id"])
+        op.create_index("ix_merchants_merchant_id", "merchants", ["merchant_id"], unique=True)
+
+    if not inspector.has_table("qris_transactions"):
+        op.create_table(
+            "qris_transactions",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("merchant_id", sa.Integer(), sa.ForeignKey("merchants.id"), nullable=False),
+            sa.Column("invoice_id", sa.String(255), nullable=False),
+            sa.Column("amount", sa.Integer(), nullable=False),
+            sa.Column("description", sa.String(500)),
+            sa.Column("status", sa.String(50)),
+            sa.Column("qris_status", sa.String(50)),
+            sa.Column("payment_method", sa.String(100)),
+            sa.Column("customer_name", sa.String(255)),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_qris_transactions_id", "qris_transactions", ["id"])
+        op.create_index("ix_qris_transactions_invoice_id", "qris_transactions", ["invoice_id"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_table("qris_transactions")
+    op.drop_table("merchants")
@@ -0,0 +1,47 @@
+"""Per-merchant invoice TTL and the partial index used by the expiry sweeper
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    # Nullable with no default, so adding it doesn't rewrite the table
+    if inspector.has_table("merchants") and "invoice_ttl_minutes" not in {
+        column["name"] for column in inspector.get_columns("merchants")
+    }:
+        op.add_column("merchants", sa.Column("invoice_ttl_minutes", sa.Integer(), nullable=True))
+
+    if inspector.has_table("qris_transactions") and "ix_qris_transactions_pending_created_at" not in {
+        index["name"] for index in inspector.get_indexes("qris_transactions")
+    }:
+        # CONCURRENTLY can't run inside a transaction, and doesn't block writes
+        with op.get_context().autocommit_block():
+            op.create_index(
+                "ix_qris_transactions_pending_created_at",
+                "qris_transactions",
+                ["created_at"],
+                postgresql_where=sa.text("status = 'pending'"),
+                sqlite_where=sa.text("status = 'pending'"),
+                postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_qris_transactions_pending_created_at", table_name="qris_transactions")
+    op.drop_column("merchants", "invoice_ttl_minutes")
@@ -0,0 +1,37 @@
+"""Composite index for per-merchant history and analytics range scans
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    if inspector.has_table("qris_transactions") and "ix_qris_transactions_merchant_created_at" not in {
+        index["name"] for index in inspector.get_indexes("qris_transactions")
+    }:
+        with op.get_context().autocommit_block():
+            op.create_index(
+                "ix_qris_transactions_merchant_created_at",
+                "qris_transactions",
+                ["merchant_id", "created_at"],
+                postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_qris_transactions_merchant_created_at", table_name="qris_transactions")
@@ -0,0 +1,37 @@
+"""Composite index for index-only max(updated_at) per merchant (list ETags)
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 09:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    if inspector.has_table("qris_transactions") and "ix_qris_transactions_merchant_updated_at" not in {
+        index["name"] for index in inspector.get_indexes("qris_transactions")
+    }:
+        with op.get_context().autocommit_block():
+            op.create_index(
+                "ix_qris_transactions_merchant_updated_at",
+                "qris_transactions",
+                ["merchant_id", "updated_at"],
+                postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_qris_transactions_merchant_updated_at", table_name="qris_transactions")
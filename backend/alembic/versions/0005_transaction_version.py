@@ -0,0 +1,59 @@
+"""Row version counter for transaction ETags
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 09:20:00.000000
+
+List ETags are built from count and sum(version) instead of max(updated_at),
+so the (merchant_id, updated_at) index is replaced by (merchant_id, version).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("qris_transactions"):
+        return
+
+    # A constant default doesn't rewrite the table on PostgreSQL 11+
+    if "version" not in {column["name"] for column in inspector.get_columns("qris_transactions")}:
+        op.add_column(
+            "qris_transactions",
+            sa.Column("version", sa.Integer(), nullable=False, server_default="1")
+        )
+
+    indexes = {index["name"] for index in inspector.get_indexes("qris_transactions")}
+    with op.get_context().autocommit_block():
+        if "ix_qris_transactions_merchant_version" not in indexes:
+            op.create_index(
+                "ix_qris_transactions_merchant_version",
+                "qris_transactions",
+                ["merchant_id", "version"],
+                postgresql_concurrently=True
+            )
+        if "ix_qris_transactions_merchant_updated_at" in indexes:
+            op.drop_index(
+                "ix_qris_transactions_merchant_updated_at",
+                table_name="qris_transactions",
+                postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    op.create_index(
+        "ix_qris_transactions_merchant_updated_at",
+        "qris_transactions",
+        ["merchant_id", "updated_at"]
+    )
+    op.drop_index("ix_qris_transactions_merchant_version", table_name="qris_transactions")
+    op.drop_column("qris_transactions", "version")
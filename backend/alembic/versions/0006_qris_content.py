@@ -0,0 +1,32 @@
+"""Stored QRIS payload for local QR rendering
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 09:25:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    # Nullable with no default, so adding it doesn't rewrite the table
+    if inspector.has_table("qris_transactions") and "qris_content" not in {
+        column["name"] for column in inspector.get_columns("qris_transactions")
+    }:
+        op.add_column("qris_transactions", sa.Column("qris_content", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("qris_transactions", "qris_content")
@@ -0,0 +1,70 @@
+"""Outbox table for asynchronously created invoices
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 09:30:00.000000
+
+Transaction shards don't hold invoice jobs.
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if context.config.attributes.get("transaction_shard"):
+        return
+    inspector = sa.inspect(op.get_bind())
+
+    if not inspector.has_table("invoice_jobs"):
+        op.create_table(
+            "invoice_jobs",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("merchant_id", sa.Integer(), sa.ForeignKey("merchants.id"), nullable=False),
+            sa.Column("amount", sa.Integer(), nullable=False),
+            sa.Column("description", sa.String(500)),
+            sa.Column("status", sa.String(50), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("last_error", sa.Text()),
+            sa.Column("available_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("locked_at", sa.DateTime(timezone=True)),
+            sa.Column("requested_at", sa.DateTime(timezone=True)),
+            sa.Column("invoice_id", sa.String(255)),
+            sa.Column("qr_code_url", sa.Text()),
+            sa.Column("qris_content", sa.Text()),
+            sa.Column("transaction_id", sa.Integer()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_invoice_jobs_id", "invoice_jobs", ["id"])
+        # A new table is empty, so a plain CREATE INDEX doesn't block anyone
+        op.create_index(
+            "ix_invoice_jobs_claimable",
+            "invoice_jobs",
+            ["available_at"],
+            postgresql_where=sa.text("status = 'pending_creation'"),
+            sqlite_where=sa.text("status = 'pending_creation'")
+        )
+        return
+
+    # Tables created by create_all before the request marker and the stored
+    # payload; nullable with no default, so adding them doesn't rewrite the table
+    columns = {column["name"] for column in inspector.get_columns("invoice_jobs")}
+    if "requested_at" not in columns:
+        op.add_column("invoice_jobs", sa.Column("requested_at", sa.DateTime(timezone=True), nullable=True))
+    if "qris_content" not in columns:
+        op.add_column("invoice_jobs", sa.Column("qris_content", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    if context.config.attributes.get("transaction_shard"):
+        return
+    op.drop_table("invoice_jobs")
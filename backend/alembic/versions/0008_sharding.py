@@ -0,0 +1,59 @@
+"""Merchant shard placement and the global invoice index
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 09:35:00.000000
+
+Transaction shards hold neither; their qris_transactions table comes from
+`python -m app.sharding init`.
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if context.config.attributes.get("transaction_shard"):
+        return
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # Nullable with no default, so adding it doesn't rewrite the table
+    if inspector.has_table("merchants") and "shard" not in {
+        column["name"] for column in inspector.get_columns("merchants")
+    }:
+        op.add_column("merchants", sa.Column("shard", sa.String(50), nullable=True))
+
+    if not inspector.has_table("invoice_index"):
+        op.create_table(
+            "invoice_index",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("invoice_id", sa.String(255), nullable=False),
+            sa.Column("merchant_id", sa.Integer(), sa.ForeignKey("merchants.id"), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_invoice_index_invoice_id", "invoice_index", ["invoice_id"], unique=True)
+        op.create_index("ix_invoice_index_merchant_id", "invoice_index", ["merchant_id"])
+
+    # A job's transaction may live on another shard. SQLite can't drop a
+    # constraint in place and doesn't enforce foreign keys by default, so
+    # only other databases lose it.
+    if inspector.has_table("invoice_jobs") and bind.dialect.name != "sqlite":
+        for foreign_key in inspector.get_foreign_keys("invoice_jobs"):
+            if foreign_key["constrained_columns"] == ["transaction_id"] and foreign_key.get("name"):
+                op.drop_constraint(foreign_key["name"], "invoice_jobs", type_="foreignkey")
+
+
+def downgrade() -> None:
+    if context.config.attributes.get("transaction_shard"):
+        return
+    op.drop_table("invoice_index")
+    op.drop_column("merchants", "shard")
@@ -0,0 +1,230 @@
+"""
+Transaction analytics for a merchant's paid QRIS transactions.
+
+Counts and sums are aggregated in SQL; percentiles and histograms are computed
+with NumPy over the amount column fetched in a single query. Results are
+cached per merchant and time range until the merchant gets a new paid
+transaction (or the cache entry's TTL runs out).
+
+Results are cached in each process, tagged with the merchant's invalidation
+generation. Set ANALYTICS_REDIS_URL (defaults to RATE_LIMIT_REDIS_URL) to
+keep the generations in Redis, so a paid transaction handled by one worker
+invalidates every worker's and instance's results. Without it the counters
+are per process: other workers keep serving their results until the TTL
+runs out, which is why it is short.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+import numpy as np
+import os
+import threading
+import time
+import logging
+
+from . import models
+from .sharding import merchant_transaction_session
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_CACHE_TTL_SECONDS = int(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "60"))
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "1024"))
+ANALYTICS_REDIS_URL = os.getenv("ANALYTICS_REDIS_URL", os.getenv("RATE_LIMIT_REDIS_URL"))
+PERCENTILES = (50, 90, 95, 99)
+
+class GenerationStore(ABC):
+    """Per-merchant invalidation counters."""
+
+    @abstractmethod
+    def get(self, merchant_id: int) -> int:
+        """Current counter for a merchant."""
+
+    @abstractmethod
+    def bump(self, merchant_id: int):
+        """Invalidate every result computed under the current counter."""
+
+class InMemoryGenerationStore(GenerationStore):
+    """Counters in process memory; only the process that bumps them sees it."""
+
+    def __init__(self):
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, merchant_id: int) -> int:
+        with self._lock:
+            return self._generations.get(merchant_id, 0)
+
+    def bump(self, merchant_id: int):
+        with self._lock:
+            self._generations[merchant_id] = self._generations.get(merchant_id, 0) + 1
+
+class RedisGenerationStore(GenerationStore):
+    """Counters shared by every worker and instance through Redis."""
+
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, merchant_id: int) -> int:
+        return int(self._client.get(f"analytics:generation:{merchant_id}") or 0)
+
+    def bump(self, merchant_id: int):
+        self._client.incr(f"analytics:generation:{merchant_id}")
+
+class AnalyticsCache:
+    """LRU cache of analytics results, invalidated per merchant."""
+
+    def __init__(self, max_entries: int, ttl: int, generations: GenerationStore):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generations = generations
+        self._entries: "OrderedDict[Tuple, Tuple[float, int, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def generation(self, merchant_id: int) -> int:
+        """Current invalidation counter for a merchant."""
+        return self.generations.get(merchant_id)
+
+    def get(self, key: Tuple, generation: int) -> Optional[Dict]:
+        """Cached result, if it is within the TTL and was computed under `generation`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, stored_generation, value = entry
+            if stored_generation != generation or time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Tuple, value: Dict, generation: int):
+        """Store a result computed under `generation` (read before computing it)."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_merchant(self, merchant_id: int):
+        """Drop every cached result for a merchant (keys start with merchant_id)."""
+        self.generations.bump(merchant_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == merchant_id]:
+                del self._entries[key]
+
+def _create_generation_store() -> GenerationStore:
+    if ANALYTICS_REDIS_URL:
+        logger.info("Using Redis analytics cache invalidation")
+        return RedisGenerationStore(ANALYTICS_REDIS_URL)
+    return InMemoryGenerationStore()
+
+analytics_cache = AnalyticsCache(ANALYTICS_CACHE_MAX_ENTRIES, ANALYTICS_CACHE_TTL_SECONDS, _create_generation_store())
+
+def invalidate_merchant_analytics(merchant_id: int):
+    """Invalidate cached analytics after a merchant's transaction becomes paid."""
+    analytics_cache.invalidate_merchant(merchant_id)
+
+def _paid_filters(merchant_id: int, start: Optional[datetime], end: Optional[datetime]) -> list:
+    filters = [
+        models.QRISTransaction.merchant_id == merchant_id,
+        models.QRISTransaction.status == "paid"
+    ]
+    if start is not None:
+        filters.append(models.QRISTransaction.created_at >= start)
+    if end is not None:
+        filters.append(models.QRISTransaction.created_at < end)
+    return filters
+
+def _amount_distribution(db: Session, filters: list, bins: int) -> Dict:
+    """Summary statistics, percentiles and histogram of transaction amounts."""
+    rows = db.execute(select(models.QRISTransaction.amount).where(*filters)).scalars().all()
+    amounts = np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+    if amounts.size == 0:
+        return {
+            "count": 0,
+            "total": 0,
+            "mean": None,
+            "min": None,
+            "max": None,
+            "percentiles": {},
+            "histogram": {"bin_edges": [], "counts": []}
+        }
+
+    counts, edges = np.histogram(amounts, bins=bins)
+    percentiles = np.percentile(amounts, PERCENTILES)
+    return {
+        "count": int(amounts.size),
+        "total": int(amounts.sum()),
+        "mean": float(amounts.mean()),
+        "min": int(amounts.min()),
+        "max": int(amounts.max()),
+        "percentiles": {f"p{p}": float(value) for p, value in zip(PERCENTILES, percentiles)},
+        "histogram": {"bin_edges": edges.tolist(), "counts": counts.tolist()}
+    }
+
+def _hourly_heatmap(db: Session, filters: list) -> list:
+    """Transaction count and volume per (day of week, hour of day), UTC."""
+    weekday = func.extract("dow", models.QRISTransaction.created_at)
+    hour = func.extract("hour", models.QRISTransaction.created_at)
+    rows = db.query(
+        weekday,
+        hour,
+        func.count(models.QRISTransaction.id),
+        func.sum(models.QRISTransaction.amount)
+    ).filter(*filters).group_by(weekday, hour).order_by(weekday, hour).all()
+
+    return [
+        {"weekday": int(day), "hour": int(hr), "count": count, "amount": int(amount or 0)}
+        for day, hr, count, amount in rows
+    ]
+
+def _payment_methods(db: Session, filters: list) -> list:
+    """Transaction count and volume per payment method."""
+    rows = db.query(
+        models.QRISTransaction.payment_method,
+        func.count(models.QRISTransaction.id),
+        func.sum(models.QRISTransaction.amount)
+    ).filter(*filters)\
+        .group_by(models.QRISTransaction.payment_method)\
+        .order_by(func.count(models.QRISTransaction.id).desc())\
+        .all()
+
+    return [
+        {"payment_method": method or "unknown", "count": count, "amount": int(amount or 0)}
+        for method, count, amount in rows
+    ]
+
+def get_transaction_analytics(
+    db: Session,
+    merchant_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bins: int = 20
+) -> Dict:
+    """Get (cached) analytics for a merchant's paid transactions in [start, end)."""
+    key = (merchant_id, start, end, bins)
+    # Read before computing, so a result racing an invalidation is stored
+    # under the old generation and never served
+    generation = analytics_cache.generation(merchant_id)
+    cached = analytics_cache.get(key, generation)
+    if cached is not None:
+        return cached
+
+    filters = _paid_filters(merchant_id, start, end)
+    result = {
+        "merchant_id": merchant_id,
+        "start": start,
+        "end": end
+    }
+    with merchant_transaction_session(db, merchant_id) as transaction_db:
+        result["amounts"] = _amount_distribution(transaction_db, filters, bins)
+        result["hourly_heatmap"] = _hourly_heatmap(transaction_db, filters)
+        result["payment_methods"] = _payment_methods(transaction_db, filters)
+    analytics_cache.set(key, result, generation)
+    return result
@@ -0,0 +1,267 @@
+"""
+Streaming bulk merchant onboarding from CSV or NDJSON.
+
+Rows are read one at a time, validated with `MerchantCreate` and written in
+batches: one query finds the merchant_ids that already exist, API keys are
+encrypted across a process pool and the batch is inserted with a single
+INSERT ... ON CONFLICT statement. Progress and per-row errors are reported as
+events while the file is being read, so memory use is bounded by the batch
+size.
+
+The API shares one process pool across uploads. It is created on first use
+with the "spawn" start method, because forking the multi-threaded server
+(with live DB pools and locks) can deadlock the children, and it is shut
+down with the app.
+
+    python -m app.bulk_import merchants.csv --batch-size 1000 --workers 4
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import threading
+
+from . import models, schemas
+from .database import SessionLocal
+from .security import encrypt_api_key
+
+FORMATS = ("csv", "ndjson")
+BULK_IMPORT_WORKERS = int(os.getenv("BULK_IMPORT_WORKERS", "4"))
+# API keys sent to a worker process per task
+ENCRYPT_CHUNK_SIZE = 100
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def create_encryption_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool for API key encryption, started with "spawn" rather than fork."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def encryption_pool() -> Optional[ProcessPoolExecutor]:
+    """The process-wide encryption pool (BULK_IMPORT_WORKERS), or None when set to 0."""
+    global _pool
+    if BULK_IMPORT_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_encryption_pool(BULK_IMPORT_WORKERS)
+        return _pool
+
+def shutdown_encryption_pool():
+    """Stop the process-wide encryption pool, if it was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+def detect_format(filename: Optional[str]) -> str:
+    """Guess the upload format from a file name (defaults to CSV)."""
+    if filename and filename.lower().endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+def iter_records(lines: Iterable[str], file_format: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """
+    Parse lines into records.
+
+    Yields:
+        Tuples of (row number, record or None, parse error or None)
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        for row_number, row in enumerate(reader, start=1):
+            # Empty CSV cells mean "not set" rather than an empty string
+            yield row_number, {key: value for key, value in row.items() if key and value not in (None, "")}, None
+        return
+
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f"Invalid JSON: {str(e)}"
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, "Each line must be a JSON object"
+            continue
+        yield row_number, record, None
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}"
+        for item in error.errors()
+    )
+
+def _encrypt_batch(api_keys: List[str]) -> List[str]:
+    """Encrypt API keys (runs in a worker process)."""
+    return [encrypt_api_key(api_key) for api_key in api_keys]
+
+def _encrypt_all(executor: Optional[Executor], api_keys: List[str]) -> List[str]:
+    if executor is None:
+        return _encrypt_batch(api_keys)
+    parts = [api_keys[i:i + ENCRYPT_CHUNK_SIZE] for i in range(0, len(api_keys), ENCRYPT_CHUNK_SIZE)]
+    return [token for part in executor.map(_encrypt_batch, parts) for token in part]
+
+def _upsert_batch(
+    db: Session,
+    merchants: List[schemas.MerchantCreate],
+    encrypted_keys: List[str],
+    on_conflict: str
+) -> Tuple[int, int]:
+    """
+    Insert a batch of merchants, updating or skipping existing merchant_ids.
+
+    Returns:
+        Tuple of (created, updated) counts
+    """
+    merchant_ids = [merchant.merchant_id for merchant in merchants]
+    existing = {
+        row[0] for row in db.query(models.Merchant.merchant_id)
+        .filter(models.Merchant.merchant_id.in_(merchant_ids))
+        .all()
+    }
+
+    values = [
+        {
+            "name": merchant.name,
+            "merchant_id": merchant.merchant_id,
+            "api_key_encrypted": encrypted_key,
+            "invoice_ttl_minutes": merchant.invoice_ttl_minutes,
+            "is_active": True
+        }
+        for merchant, encrypted_key in zip(merchants, encrypted_keys)
+    ]
+
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(models.Merchant.__table__).values(values)
+    if on_conflict == "update":
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["merchant_id"],
+            set_={
+                "name": stmt.excluded.name,
+                "api_key_encrypted": stmt.excluded.api_key_encrypted,
+                "invoice_ttl_minutes": stmt.excluded.invoice_ttl_minutes,
+                "updated_at": func.now()
+            }
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["merchant_id"])
+
+    db.execute(stmt)
+    db.commit()
+
+    created = len(merchants) - len(existing)
+    return created, len(existing) if on_conflict == "update" else 0
+
+def import_merchants(
+    lines: Iterable[str],
+    file_format: str = "csv",
+    batch_size: int = 1000,
+    executor: Optional[Executor] = None,
+    on_conflict: str = "update"
+) -> Iterator[Dict]:
+    """
+    Import merchants from CSV or NDJSON lines.
+
+    Args:
+        lines: Iterable of text lines (a file object works)
+        file_format: "csv" (header row with name, merchant_id, api_key and an
+            optional invoice_ttl_minutes column) or "ndjson" (one object per line)
+        batch_size: Rows validated, encrypted and inserted per batch
+        executor: Process pool for API key encryption (None encrypts inline);
+            the API passes the shared encryption_pool()
+        on_conflict: "update" existing merchants or "skip" them
+
+    Yields:
+        "error" events for rejected rows, a "progress" event per batch and a
+        final "done" event with the totals
+    """
+    stats = {"processed": 0, "created": 0, "updated": 0, "skipped": 0, "failed": 0}
+    seen = set()
+    batch: List[schemas.MerchantCreate] = []
+
+    db = SessionLocal()
+
+    def flush():
+        encrypted_keys = _encrypt_all(executor, [merchant.api_key for merchant in batch])
+        created, updated = _upsert_batch(db, batch, encrypted_keys, on_conflict)
+        stats["created"] += created
+        stats["updated"] += updated
+        stats["skipped"] += len(batch) - created - updated
+        batch.clear()
+
+    try:
+        for row_number, record, error in iter_records(lines, file_format):
+            stats["processed"] += 1
+
+            merchant = None
+            if error is None:
+                try:
+                    merchant = schemas.MerchantCreate.model_validate(record)
+                except ValidationError as e:
+                    error = _format_validation_error(e)
+            if merchant is not None and merchant.merchant_id in seen:
+                error = "Duplicate merchant_id in upload"
+
+            if error is not None:
+                stats["failed"] += 1
+                yield {
+                    "event": "error",
+                    "row": row_number,
+                    "merchant_id": (record or {}).get("merchant_id"),
+                    "error": error
+                }
+                continue
+
+            seen.add(merchant.merchant_id)
+            batch.append(merchant)
+            if len(batch) >= batch_size:
+                flush()
+                yield {"event": "progress", **stats}
+
+        if batch:
+            flush()
+        yield {"event": "done", **stats}
+    finally:
+        db.close()
+
+def main():
+    """Command line entry point for bulk merchant import."""
+    parser = argparse.ArgumentParser(description="Bulk import merchants from CSV or NDJSON")
+    parser.add_argument("path", help="File to import, or - for stdin")
+    parser.add_argument("--format", choices=FORMATS, default=None)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=BULK_IMPORT_WORKERS)
+    parser.add_argument("--on-conflict", choices=("update", "skip"), default="update")
+    args = parser.parse_args()
+
+    file_format = args.format or detect_format(args.path)
+    source = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    executor = create_encryption_pool(args.workers) if args.workers > 0 else None
+    try:
+        for event in import_merchants(
+            source,
+            file_format=file_format,
+            batch_size=args.batch_size,
+            executor=executor,
+            on_conflict=args.on_conflict
+        ):
+            print(json.dumps(event), flush=True)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if source is not sys.stdin:
+            source.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Brotli is used when the client accepts it and the `brotli` package is
+installed, gzip otherwise. Only textual responses at least `minimum_size`
+bytes long are compressed, so small responses like /health go out as-is.
+"""
+from starlette.datastructures import Headers, MutableHeaders
+from typing import Dict, Optional
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "image/svg+xml")
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {coding: q}."""
+    codings = {}
+    for item in header.split(","):
+        parts = [part.strip() for part in item.split(";")]
+        if not parts[0]:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        codings[parts[0].lower()] = q
+    return codings
+
+def choose_encoding(header: str) -> Optional[str]:
+    """Pick the best supported encoding the client accepts, or None."""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = codings.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+class CompressionMiddleware:
+    """ASGI middleware compressing large textual responses with br or gzip."""
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await _CompressionResponder(self, encoding, send).run(scope, receive)
+
+    def compress(self, encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+class _CompressionResponder:
+    """Buffers one compressible response and sends it compressed if it is large enough."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.passthrough = False
+        self.chunks = []
+
+    async def run(self, scope, receive):
+        await self.middleware.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        self.chunks.append(message.get("body", b""))
+        if message.get("more_body", False):
+            return
+
+        body = b"".join(self.chunks)
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        if len(body) >= self.middleware.minimum_size:
+            body = self.middleware.compress(self.encoding, body)
+            headers["Content-Encoding"] = self.encoding
+            headers["Content-Length"] = str(len(body))
+        headers.add_vary_header("Accept-Encoding")
+
+        await self.send(self.start_message)
+        await self.send({"type": "http.response.body", "body": body})
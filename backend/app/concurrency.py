@@ -0,0 +1,198 @@
+"""
+Adaptive concurrency limiting for routes that call the QRIS provider.
+
+The limit on concurrent upstream-calling requests adapts to observed
+provider latency. It grows by about one per round of `limit` completions
+while latency stays within CONCURRENCY_LATENCY_TOLERANCE times the no-load
+baseline, and shrinks in proportion to the latency gradient once it doesn't.
+Admission is an async route dependency, so it runs on the event loop before
+the endpoint or sync dependencies such as get_db take a threadpool thread:
+requests over the limit are rejected straight away with a 503 instead of
+queueing for a thread, and the instance sheds load before latency collapses.
+
+Latency is measured around the provider calls themselves (QRISService
+reports each call), not around the whole request, so fast 404/429 responses
+don't drag the baseline down.
+"""
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, Optional
+from fastapi import HTTPException, status
+import math
+import os
+import threading
+import time
+
+CONCURRENCY_INITIAL_LIMIT = int(os.getenv("CONCURRENCY_INITIAL_LIMIT", "20"))
+CONCURRENCY_MIN_LIMIT = int(os.getenv("CONCURRENCY_MIN_LIMIT", "2"))
+CONCURRENCY_MAX_LIMIT = int(os.getenv("CONCURRENCY_MAX_LIMIT", "200"))
+CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("CONCURRENCY_LATENCY_TOLERANCE", "2.0"))
+UPSTREAM_STATS_WINDOW_SECONDS = float(os.getenv("UPSTREAM_STATS_WINDOW_SECONDS", "60"))
+
+# Smoothing of the recent latency, and how fast the baseline may drift up so
+# a provider that became slower for good doesn't pin the limit at the minimum
+LATENCY_SMOOTHING = 0.2
+BASELINE_DRIFT = 0.001
+# A single decrease never cuts the limit by more than half
+MIN_GRADIENT = 0.5
+
+class UpstreamStats:
+    """Provider call latencies and failures over a sliding time window."""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._calls: deque = deque()
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            self._calls.append((now, latency, ok))
+            self._trim(now)
+
+    def _trim(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def snapshot(self) -> Dict:
+        """Call count, error rate and latency percentiles (ms) in the window."""
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = list(self._calls)
+
+        if not calls:
+            return {"calls": 0, "error_rate": 0.0, "p50_ms": None, "p95_ms": None}
+
+        latencies = sorted(latency for _, latency, _ in calls)
+        errors = sum(1 for _, _, ok in calls if not ok)
+
+        def percentile(p: float) -> float:
+            index = min(len(latencies) - 1, math.ceil(p / 100 * len(latencies)) - 1)
+            return round(latencies[index] * 1000, 1)
+
+        return {
+            "calls": len(calls),
+            "error_rate": round(errors / len(calls), 4),
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95)
+        }
+
+class _Slot:
+    """One admitted request; collects the time it spent waiting on the provider."""
+
+    def __init__(self, started_at: float, inflight: int):
+        self.started_at = started_at
+        self.inflight = inflight
+        self.upstream_latency = 0.0
+        self.upstream_calls = 0
+
+_current_slot: ContextVar[Optional[_Slot]] = ContextVar("concurrency_slot", default=None)
+
+class AdaptiveConcurrencyLimiter:
+    """Latency-gradient limit on concurrent requests, with additive increase."""
+
+    def __init__(
+        self,
+        initial_limit: int = CONCURRENCY_INITIAL_LIMIT,
+        min_limit: int = CONCURRENCY_MIN_LIMIT,
+        max_limit: int = CONCURRENCY_MAX_LIMIT,
+        tolerance: float = CONCURRENCY_LATENCY_TOLERANCE
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self._limit = float(max(min_limit, min(max_limit, initial_limit)))
+        self._inflight = 0
+        self._baseline: Optional[float] = None
+        self._smoothed: Optional[float] = None
+        self._last_decrease = 0.0
+        self._accepted = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> Optional[_Slot]:
+        """Admit a request, or return None if the limit is reached."""
+        with self._lock:
+            if self._inflight >= int(self._limit):
+                self._rejected += 1
+                return None
+            self._inflight += 1
+            self._accepted += 1
+            return _Slot(time.monotonic(), self._inflight)
+
+    def release(self, slot: _Slot):
+        """Finish a request and adapt the limit to the provider latency it saw."""
+        with self._lock:
+            self._inflight -= 1
+            if slot.upstream_calls:
+                self._update(slot)
+
+    def _update(self, slot: _Slot):
+        sample = slot.upstream_latency
+        if self._baseline is None or sample < self._baseline:
+            self._baseline = sample
+        else:
+            self._baseline += (sample - self._baseline) * BASELINE_DRIFT
+        if self._smoothed is None:
+            self._smoothed = sample
+        else:
+            self._smoothed += (sample - self._smoothed) * LATENCY_SMOOTHING
+
+        gradient = self.tolerance * self._baseline / self._smoothed if self._smoothed > 0 else 1.0
+        if gradient < 1.0:
+            # Requests admitted before the last decrease saw the old load; one
+            # decrease per generation keeps a slow burst from collapsing the limit
+            if slot.started_at > self._last_decrease:
+                self._limit = max(self.min_limit, self._limit * max(MIN_GRADIENT, gradient))
+                self._last_decrease = time.monotonic()
+        elif slot.inflight * 2 >= self._limit:
+            # Only grow while the limit is actually being used
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+
+    async def admit(self):
+        """
+        Route dependency admitting a request or rejecting it with 503.
+
+        Declare it in the route decorator's `dependencies`, which FastAPI
+        resolves before the endpoint's own parameters. The slot is held until
+        the response has been sent.
+        """
+        slot = self.try_acquire()
+        if slot is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is at capacity, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        # Copied into the threadpool thread that runs the endpoint, where
+        # QRISService reports its calls
+        _current_slot.set(slot)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            limit = int(self._limit)
+            return {
+                "limit": limit,
+                "inflight": self._inflight,
+                "saturation": round(self._inflight / limit, 4) if limit else 1.0,
+                "accepted": self._accepted,
+                "rejected": self._rejected,
+                "baseline_ms": round(self._baseline * 1000, 1) if self._baseline is not None else None,
+                "smoothed_ms": round(self._smoothed * 1000, 1) if self._smoothed is not None else None
+            }
+
+upstream_stats = UpstreamStats(UPSTREAM_STATS_WINDOW_SECONDS)
+upstream_limiter = AdaptiveConcurrencyLimiter()
+
+def record_upstream_call(latency: float, ok: bool):
+    """Record one provider call for /ready and for the request's limiter slot."""
+    upstream_stats.record(latency, ok)
+    slot = _current_slot.get()
+    if slot is not None:
+        slot.upstream_latency += latency
+        slot.upstream_calls += 1
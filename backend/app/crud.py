@@ -1,8 +1,19 @@
+from contextlib import contextmanager
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List, Optional
+from sqlalchemy import desc, func
+from typing import Iterator, List, Optional, Tuple
+from datetime import datetime, timezone
 from . import models, schemas
 from .security import encrypt_api_key, decrypt_api_key
+from .analytics import invalidate_merchant_analytics
+from .database import mark_write
+from .sharding import (
+    SHARDING_ENABLED,
+    allocate_transaction_id,
+    merchant_for_invoice_id,
+    merchant_for_transaction_id,
+    merchant_transaction_session,
+)
 
 # Merchant CRUD operations
 def create_merchant(db: Session, merchant: schemas.MerchantCreate) -> models.Merchant:
@@ -14,24 +25,36 @@ def create_merchant(db: Session, merchant: schemas.MerchantCreate) -> models.Mer
         name=merchant.name,
         merchant_id=merchant.merchant_id,
         api_key_encrypted=encrypted_api_key,
-        is_active=True
+        is_active=True,
+        invoice_ttl_minutes=merchant.invoice_ttl_minutes
     )
     db.add(db_merchant)
     db.commit()
     db.refresh(db_merchant)
+    mark_write(db_merchant.id)
     return db_merchant
 
 def get_merchant(db: Session, merchant_id: int) -> Optional[models.Merchant]:
     """Get a merchant by ID."""
     return db.query(models.Merchant).filter(models.Merchant.id == merchant_id).first()
 
+def get_merchant_updated_at(db: Session, merchant_id: int) -> Optional[datetime]:
+    """Get only the updated_at of a merchant (for ETags); None if it doesn't exist."""
+    return db.query(models.Merchant.updated_at).filter(models.Merchant.id == merchant_id).scalar()
+
 def get_merchant_by_merchant_id(db: Session, merchant_id: str) -> Optional[models.Merchant]:
     """Get a merchant by merchant_id."""
     return db.query(models.Merchant).filter(models.Merchant.merchant_id == merchant_id).first()
 
-def get_merchants(db: Session, skip: int = 0, limit: int = 100) -> List[models.Merchant]:
-    """Get all merchants with pagination."""
-    return db.query(models.Merchant).offset(skip).limit(limit).all()
+def get_merchants(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[List[str]] = None
+) -> List[models.Merchant]:
+    """Get all merchants with pagination, optionally selecting only `fields` (returns rows)."""
+    columns = [getattr(models.Merchant, field) for field in fields] if fields else [models.Merchant]
+    return db.query(*columns).offset(skip).limit(limit).all()
 
 def update_merchant(db: Session, merchant_id: int, merchant_update: schemas.MerchantUpdate) -> Optional[models.Merchant]:
     """Update a merchant."""
@@ -50,6 +73,7 @@ def update_merchant(db: Session, merchant_id: int, merchant_update: schemas.Merc
     
     db.commit()
     db.refresh(db_merchant)
+    mark_write(merchant_id)
     return db_merchant
 
 def delete_merchant(db: Session, merchant_id: int) -> bool:
@@ -60,6 +84,7 @@ def delete_merchant(db: Session, merchant_id: int) -> bool:
     
     db.delete(db_merchant)
     db.commit()
+    mark_write(merchant_id)
     return True
 
 def get_merchant_decrypted_api_key(db: Session, merchant_id: int) -> Optional[str]:
@@ -71,41 +96,93 @@ def get_merchant_decrypted_api_key(db: Session, merchant_id: int) -> Optional[st
     return decrypt_api_key(db_merchant.api_key_encrypted)
 
 # QRIS Transaction CRUD operations
-def create_qris_transaction(db: Session, transaction: schemas.QRISTransactionCreate, invoice_id: str) -> models.QRISTransaction:
+# Transactions are read and written on their merchant's shard (app.sharding);
+# without TRANSACTION_SHARD_URLS that is `db` itself.
+@contextmanager
+def _transaction_session_for_id(db: Session, transaction_id: int) -> Iterator[Optional[Session]]:
+    """Session holding a transaction by id, or None if it isn't in the invoice index."""
+    if not SHARDING_ENABLED:
+        yield db
+        return
+    merchant_id = merchant_for_transaction_id(db, transaction_id)
+    if merchant_id is None:
+        yield None
+        return
+    with merchant_transaction_session(db, merchant_id) as transaction_db:
+        yield transaction_db
+
+def create_qris_transaction(
+    db: Session,
+    transaction: schemas.QRISTransactionCreate,
+    invoice_id: str,
+    qris_content: Optional[str] = None
+) -> models.QRISTransaction:
     """Create a new QRIS transaction."""
-    db_transaction = models.QRISTransaction(
-        merchant_id=transaction.merchant_id,
-        invoice_id=invoice_id,
-        amount=transaction.amount,
-        description=transaction.description,
-        status="pending"
-    )
-    db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
+    transaction_id = allocate_transaction_id(db, invoice_id, transaction.merchant_id)
+    with merchant_transaction_session(db, transaction.merchant_id) as transaction_db:
+        db_transaction = models.QRISTransaction(
+            id=transaction_id,
+            merchant_id=transaction.merchant_id,
+            invoice_id=invoice_id,
+            amount=transaction.amount,
+            description=transaction.description,
+            status="pending",
+            qris_content=qris_content
+        )
+        transaction_db.add(db_transaction)
+        transaction_db.commit()
+        transaction_db.refresh(db_transaction)
+    mark_write(db_transaction.merchant_id)
     return db_transaction
 
 def get_qris_transaction(db: Session, transaction_id: int) -> Optional[models.QRISTransaction]:
     """Get a QRIS transaction by ID."""
-    return db.query(models.QRISTransaction).filter(models.QRISTransaction.id == transaction_id).first()
+    with _transaction_session_for_id(db, transaction_id) as transaction_db:
+        if transaction_db is None:
+            return None
+        return transaction_db.query(models.QRISTransaction)\
+            .filter(models.QRISTransaction.id == transaction_id)\
+            .first()
+
+def get_qris_transaction_version(db: Session, transaction_id: int) -> Optional[Tuple[int, int]]:
+    """Get only the merchant_id and version of a QRIS transaction (for ETags); None if it doesn't exist."""
+    with _transaction_session_for_id(db, transaction_id) as transaction_db:
+        if transaction_db is None:
+            return None
+        row = transaction_db.query(models.QRISTransaction.merchant_id, models.QRISTransaction.version)\
+            .filter(models.QRISTransaction.id == transaction_id)\
+            .first()
+        return tuple(row) if row is not None else None
 
 def get_qris_transaction_by_invoice_id(db: Session, invoice_id: str) -> Optional[models.QRISTransaction]:
-    """Get a QRIS transaction by invoice ID."""
-    return db.query(models.QRISTransaction).filter(models.QRISTransaction.invoice_id == invoice_id).first()
+    """Get a QRIS transaction by invoice ID (through the global invoice index when sharded)."""
+    if not SHARDING_ENABLED:
+        return db.query(models.QRISTransaction).filter(models.QRISTransaction.invoice_id == invoice_id).first()
+
+    merchant_id = merchant_for_invoice_id(db, invoice_id)
+    if merchant_id is None:
+        return None
+    with merchant_transaction_session(db, merchant_id) as transaction_db:
+        return transaction_db.query(models.QRISTransaction)\
+            .filter(models.QRISTransaction.invoice_id == invoice_id)\
+            .first()
 
 def get_qris_transactions_by_merchant(
     db: Session, 
     merchant_id: int, 
     skip: int = 0, 
-    limit: int = 20
+    limit: int = 20,
+    fields: Optional[List[str]] = None
 ) -> List[models.QRISTransaction]:
-    """Get QRIS transactions for a specific merchant with pagination."""
-    return db.query(models.QRISTransaction)\
-        .filter(models.QRISTransaction.merchant_id == merchant_id)\
-        .order_by(desc(models.QRISTransaction.created_at))\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
+    """Get QRIS transactions for a specific merchant with pagination, optionally selecting only `fields` (returns rows)."""
+    columns = [getattr(models.QRISTransaction, field) for field in fields] if fields else [models.QRISTransaction]
+    with merchant_transaction_session(db, merchant_id) as transaction_db:
+        return transaction_db.query(*columns)\
+            .filter(models.QRISTransaction.merchant_id == merchant_id)\
+            .order_by(desc(models.QRISTransaction.created_at))\
+            .offset(skip)\
+            .limit(limit)\
+            .all()
 
 def update_qris_transaction_status(
     db: Session, 
@@ -115,24 +192,75 @@ def update_qris_transaction_status(
     customer_name: Optional[str] = None
 ) -> Optional[models.QRISTransaction]:
     """Update QRIS transaction status."""
-    db_transaction = get_qris_transaction(db, transaction_id)
-    if not db_transaction:
-        return None
-    
-    db_transaction.qris_status = qris_status
-    db_transaction.status = "paid" if qris_status == "paid" else "pending"
-    
-    if payment_method:
-        db_transaction.payment_method = payment_method
-    if customer_name:
-        db_transaction.customer_name = customer_name
-    
-    db.commit()
-    db.refresh(db_transaction)
+    with _transaction_session_for_id(db, transaction_id) as transaction_db:
+        if transaction_db is None:
+            return None
+        db_transaction = transaction_db.query(models.QRISTransaction)\
+            .filter(models.QRISTransaction.id == transaction_id)\
+            .first()
+        if not db_transaction:
+            return None
+        
+        was_paid = db_transaction.status == "paid"
+        changes = {"qris_status": qris_status}
+        if qris_status == "paid":
+            changes["status"] = "paid"
+        elif db_transaction.status != "expired":
+            changes["status"] = "pending"
+        if payment_method:
+            changes["payment_method"] = payment_method
+        if customer_name:
+            changes["customer_name"] = customer_name
+        
+        changes = {field: value for field, value in changes.items() if getattr(db_transaction, field) != value}
+        if not changes:
+            # Repeated polls with the same answer leave the version, and so
+            # the list and detail ETags, untouched
+            return db_transaction
+        
+        for field, value in changes.items():
+            setattr(db_transaction, field, value)
+        db_transaction.version = models.QRISTransaction.version + 1
+        # Stamp at commit time rather than transaction start (the session may
+        # have been open across the upstream call)
+        db_transaction.updated_at = datetime.now(timezone.utc)
+        transaction_db.commit()
+        transaction_db.refresh(db_transaction)
+    mark_write(db_transaction.merchant_id)
+
+    if db_transaction.status == "paid" and not was_paid:
+        invalidate_merchant_analytics(db_transaction.merchant_id)
     return db_transaction
 
-def get_transactions_count_by_merchant(db: Session, merchant_id: int) -> int:
-    """Get total count of transactions for a merchant."""
-    return db.query(models.QRISTransaction)\
-        .filter(models.QRISTransaction.merchant_id == merchant_id)\
-        .count()
+def get_transactions_version_by_merchant(db: Session, merchant_id: int) -> Tuple[int, int]:
+    """
+    Get the transaction count and sum of row versions for a merchant in one query.
+
+    Every UPDATE increments its row's version, so the sum grows with each
+    committed change whatever the order of commits or the clocks involved.
+    """
+    with merchant_transaction_session(db, merchant_id) as transaction_db:
+        count, versions = transaction_db.query(
+            func.count(),
+            func.coalesce(func.sum(models.QRISTransaction.version), 0)
+        ).filter(models.QRISTransaction.merchant_id == merchant_id).one()
+    return count, int(versions)
+
+# Invoice job (outbox) CRUD operations
+def create_invoice_job(db: Session, transaction: schemas.QRISTransactionCreate) -> models.InvoiceJob:
+    """Queue an invoice for asynchronous creation."""
+    db_job = models.InvoiceJob(
+        merchant_id=transaction.merchant_id,
+        amount=transaction.amount,
+        description=transaction.description,
+        status="pending_creation",
+        attempts=0
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_invoice_job(db: Session, job_id: int) -> Optional[models.InvoiceJob]:
+    """Get an invoice job by ID."""
+    return db.query(models.InvoiceJob).filter(models.InvoiceJob.id == job_id).first()
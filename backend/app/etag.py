@@ -0,0 +1,45 @@
+"""
+Weak ETag helpers for conditional GET.
+
+ETags are derived from cheap version data (row counts and versions)
+so a matching If-None-Match can be answered with 304 before the full query
+and serialization run.
+"""
+from fastapi import Request, Response, status
+from typing import Optional
+import hashlib
+
+def make_etag(*parts) -> str:
+    """Build a weak ETag from the given version parts."""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check If-None-Match against an ETag using weak comparison."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def not_modified(etag: str) -> Response:
+    """Empty 304 response carrying the ETag."""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"}
+    )
+
+def set_etag(response: Response, etag: Optional[str]):
+    """Attach the ETag and ask clients to revalidate before reusing the body."""
+    if etag:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
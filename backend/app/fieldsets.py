@@ -0,0 +1,41 @@
+"""
+Sparse fieldsets for list endpoints (`?fields=id,amount,status`).
+
+The requested fields narrow both the SELECT column list and the serialized
+payload. The primary key is always included.
+"""
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from typing import Dict, List, Optional, Type
+
+def parse_fields(fields: Optional[str], schema: Type[BaseModel]) -> Optional[List[str]]:
+    """
+    Validate a comma-separated field list against a response schema.
+
+    Returns:
+        Ordered list of field names (always starting with `id`), or None for all fields
+
+    Raises:
+        HTTPException: 400 if an unknown field is requested
+    """
+    if not fields:
+        return None
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in schema.model_fields]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+
+    selected = ["id"]
+    for field in requested:
+        if field not in selected:
+            selected.append(field)
+    return selected
+
+def rows_to_dicts(rows) -> List[Dict]:
+    """Convert rows from a column-narrowed query into JSON-ready dicts."""
+    return jsonable_encoder([dict(row._mapping) for row in rows])
@@ -0,0 +1,186 @@
+"""
+Invoice expiry lifecycle.
+
+Pending invoices older than their merchant's TTL (or INVOICE_TTL_MINUTES) are
+moved to the `expired` status by a periodic sweeper, in bounded batches so a
+backlog never turns into one long-running UPDATE.
+
+    python -m app.invoice_expiry --once
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import ColumnElement, func
+from sqlalchemy.orm import Session
+import argparse
+import os
+import threading
+import time
+import logging
+
+from . import models
+from .database import SessionLocal
+from .sharding import iter_transaction_sessions, merchant_transaction_session
+
+logger = logging.getLogger(__name__)
+
+INVOICE_TTL_MINUTES = int(os.getenv("INVOICE_TTL_MINUTES", "60"))
+INVOICE_SWEEP_INTERVAL_SECONDS = int(os.getenv("INVOICE_SWEEP_INTERVAL_SECONDS", "60"))
+INVOICE_SWEEP_BATCH_SIZE = int(os.getenv("INVOICE_SWEEP_BATCH_SIZE", "1000"))
+
+def get_invoice_ttl(merchant: models.Merchant) -> timedelta:
+    """Get the invoice time-to-live for a merchant."""
+    return timedelta(minutes=merchant.invoice_ttl_minutes or INVOICE_TTL_MINUTES)
+
+def is_transaction_expired(
+    transaction: models.QRISTransaction,
+    merchant: models.Merchant,
+    now: Optional[datetime] = None
+) -> bool:
+    """Check whether a transaction is expired or is pending past its TTL."""
+    if transaction.status == "expired":
+        return True
+    if transaction.status != "pending" or transaction.created_at is None:
+        return False
+
+    now = now or datetime.now(timezone.utc)
+    created_at = transaction.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at + get_invoice_ttl(merchant) <= now
+
+# Bumping the version changes the list and detail ETags
+_EXPIRED = {
+    "status": "expired",
+    "version": models.QRISTransaction.version + 1,
+    "updated_at": func.now()
+}
+
+def expire_transaction(db: Session, transaction: models.QRISTransaction) -> models.QRISTransaction:
+    """Mark a single pending transaction as expired."""
+    with merchant_transaction_session(db, transaction.merchant_id) as transaction_db:
+        transaction_db.query(models.QRISTransaction)\
+            .filter(models.QRISTransaction.id == transaction.id, models.QRISTransaction.status == "pending")\
+            .update(_EXPIRED, synchronize_session=False)
+        transaction_db.commit()
+    # The row may live on another shard than `transaction`'s session
+    transaction.status = "expired"
+    return transaction
+
+def _ttl_groups(db: Session) -> List[Tuple[int, ColumnElement]]:
+    """
+    (TTL minutes, merchant filter) pairs covering every merchant.
+
+    Merchant ids are listed explicitly rather than selected from merchants,
+    because with sharding the transactions are on other databases. Only
+    merchants that override the TTL are listed; everyone else falls in the
+    default group as "not one of those".
+    """
+    overrides: Dict[int, List[int]] = {}
+    for merchant_id, ttl in db.query(models.Merchant.id, models.Merchant.invoice_ttl_minutes)\
+            .filter(
+                models.Merchant.invoice_ttl_minutes.isnot(None),
+                models.Merchant.invoice_ttl_minutes != INVOICE_TTL_MINUTES
+            ):
+        overrides.setdefault(ttl, []).append(merchant_id)
+
+    overridden = [merchant_id for ids in overrides.values() for merchant_id in ids]
+    groups = [(INVOICE_TTL_MINUTES, models.QRISTransaction.merchant_id.notin_(overridden))]
+    groups.extend((ttl, models.QRISTransaction.merchant_id.in_(ids)) for ttl, ids in overrides.items())
+    return groups
+
+def expire_stale_transactions(
+    db: Session,
+    batch_size: int = INVOICE_SWEEP_BATCH_SIZE,
+    now: Optional[datetime] = None
+) -> int:
+    """
+    Expire pending transactions older than their merchant's TTL.
+
+    Merchants are grouped by effective TTL so each group needs a single
+    created_at cutoff, which the partial index over pending rows serves.
+    Every batch is a separate UPDATE and commit, run on each transaction shard.
+
+    Returns:
+        Number of transactions expired
+    """
+    now = now or datetime.now(timezone.utc)
+    groups = _ttl_groups(db)
+    expired = 0
+
+    for transaction_db in iter_transaction_sessions(db):
+        for ttl, merchant_filter in groups:
+            cutoff = now - timedelta(minutes=ttl)
+
+            while True:
+                ids = [
+                    row[0] for row in transaction_db.query(models.QRISTransaction.id)
+                    .filter(
+                        models.QRISTransaction.status == "pending",
+                        models.QRISTransaction.created_at < cutoff,
+                        merchant_filter
+                    )
+                    .limit(batch_size)
+                    .all()
+                ]
+                if not ids:
+                    break
+
+                expired += transaction_db.query(models.QRISTransaction)\
+                    .filter(models.QRISTransaction.id.in_(ids), models.QRISTransaction.status == "pending")\
+                    .update(_EXPIRED, synchronize_session=False)
+                transaction_db.commit()
+
+    return expired
+
+def sweep_once(batch_size: int = INVOICE_SWEEP_BATCH_SIZE) -> int:
+    """Run one sweep with its own session."""
+    db = SessionLocal()
+    try:
+        expired = expire_stale_transactions(db, batch_size=batch_size)
+        if expired:
+            logger.info(f"Expired {expired} stale QRIS invoices")
+        return expired
+    finally:
+        db.close()
+
+def _sweep_forever(interval: int, stop_event: threading.Event):
+    while not stop_event.wait(interval):
+        try:
+            sweep_once()
+        except Exception as e:
+            logger.error(f"Invoice expiry sweep failed: {str(e)}")
+
+def start_sweeper(interval: int = INVOICE_SWEEP_INTERVAL_SECONDS) -> Optional[threading.Event]:
+    """
+    Start the periodic sweeper in a daemon thread.
+
+    Returns:
+        Event that stops the sweeper when set, or None if disabled (interval <= 0)
+    """
+    if interval <= 0:
+        return None
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_sweep_forever, args=(interval, stop_event), name="invoice-expiry", daemon=True)
+    thread.start()
+    return stop_event
+
+def main():
+    """Command line entry point for the expiry sweeper."""
+    parser = argparse.ArgumentParser(description="Expire stale pending QRIS invoices")
+    parser.add_argument("--once", action="store_true", help="Run a single sweep and exit")
+    parser.add_argument("--interval", type=int, default=INVOICE_SWEEP_INTERVAL_SECONDS)
+    parser.add_argument("--batch-size", type=int, default=INVOICE_SWEEP_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.once:
+        sweep_once(batch_size=args.batch_size)
+        return
+
+    while True:
+        sweep_once(batch_size=args.batch_size)
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Workers for asynchronously created invoices (the invoice_jobs outbox).
+
+Workers claim one job at a time with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of workers across processes and hosts can share the table without
+handing out the same job twice. A claimed job is leased: if its worker dies
+before finalizing, the job becomes claimable again after
+INVOICE_JOB_LEASE_SECONDS, which is kept longer than one upstream call. Every
+update after the claim is a compare-and-set on locked_at, so a worker that
+lost its lease drops its result instead of overwriting the new owner's.
+
+A job is never sent upstream twice: requested_at is committed before the
+call, and the invoice the provider returns is stored on the job before the
+transaction is recorded. A retry that finds a request recorded without a
+result fails the job for reconciliation against its cliTrxNumber rather than
+relying on the provider to deduplicate it.
+
+    python -m app.invoice_worker --workers 8
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+import argparse
+import asyncio
+import os
+import threading
+import time
+import logging
+
+from . import crud, models, schemas
+from .database import SessionLocal
+from .qris_service import QRIS_TIMEOUT_SECONDS, InvoiceNotCreated, QRISService
+from .qr_render import prewarm_qr_images
+
+logger = logging.getLogger(__name__)
+
+INVOICE_WORKERS = int(os.getenv("INVOICE_WORKERS", "0"))
+INVOICE_JOB_BATCH_SIZE = int(os.getenv("INVOICE_JOB_BATCH_SIZE", "5"))
+INVOICE_JOB_POLL_SECONDS = float(os.getenv("INVOICE_JOB_POLL_SECONDS", "1"))
+# A lease covers one job, so it must outlast the upstream connect and read
+# timeouts plus the DB work around them
+INVOICE_JOB_LEASE_SECONDS = max(int(os.getenv("INVOICE_JOB_LEASE_SECONDS", "120")), 3 * QRIS_TIMEOUT_SECONDS)
+INVOICE_JOB_MAX_ATTEMPTS = int(os.getenv("INVOICE_JOB_MAX_ATTEMPTS", "5"))
+
+def job_reference(job: models.InvoiceJob) -> str:
+    """Stable client transaction number for a job."""
+    return f"JOB{job.id}"
+
+def claim_job(db: Session) -> Optional[models.InvoiceJob]:
+    """
+    Claim the next due job, including a processing job whose lease expired.
+
+    The claim is committed before any upstream call, so no row lock is held
+    while talking to the provider. Its locked_at identifies the lease.
+    """
+    now = datetime.now(timezone.utc)
+    lease_cutoff = now - timedelta(seconds=INVOICE_JOB_LEASE_SECONDS)
+
+    job = db.query(models.InvoiceJob)\
+        .filter(or_(
+            (models.InvoiceJob.status == "pending_creation") & (models.InvoiceJob.available_at <= now),
+            (models.InvoiceJob.status == "processing") & (models.InvoiceJob.locked_at < lease_cutoff)
+        ))\
+        .order_by(models.InvoiceJob.id)\
+        .limit(1)\
+        .with_for_update(skip_locked=True)\
+        .first()
+    if job is None:
+        db.rollback()
+        return None
+
+    job.status = "processing"
+    job.locked_at = now
+    job.attempts += 1
+    db.commit()
+    return job
+
+def _update_claimed(db: Session, job: models.InvoiceJob, claimed_at: datetime, **values) -> bool:
+    """Update a job only while the lease taken at `claimed_at` still holds; False if it was lost."""
+    updated = db.query(models.InvoiceJob)\
+        .filter(models.InvoiceJob.id == job.id, models.InvoiceJob.locked_at == claimed_at)\
+        .update(values, synchronize_session=False)
+    db.commit()
+    if not updated:
+        logger.warning(f"Invoice job {job.id} lost its lease; dropping this worker's result")
+    return bool(updated)
+
+def _fail(db: Session, job: models.InvoiceJob, claimed_at: datetime, error: str):
+    if _update_claimed(db, job, claimed_at, status="failed", last_error=error, locked_at=None):
+        logger.error(f"Invoice job {job.id} failed after {job.attempts} attempts: {error}")
+
+def _retry_or_fail(db: Session, job: models.InvoiceJob, claimed_at: datetime, error: str):
+    """Retry a job whose upstream request certainly created nothing, or fail it after the last attempt."""
+    if job.attempts >= INVOICE_JOB_MAX_ATTEMPTS:
+        _fail(db, job, claimed_at, error)
+        return
+    # Exponential backoff: 2, 4, 8, ... seconds
+    _update_claimed(
+        db, job, claimed_at,
+        status="pending_creation",
+        available_at=datetime.now(timezone.utc) + timedelta(seconds=2 ** job.attempts),
+        requested_at=None,
+        locked_at=None,
+        last_error=error
+    )
+
+def _unknown_outcome(job: models.InvoiceJob, reason: str) -> str:
+    return f"{reason}; check the provider for cliTrxNumber {job_reference(job)} before creating it again"
+
+def process_job(db: Session, job: models.InvoiceJob, qris_service: Optional[QRISService] = None):
+    """Create the upstream invoice for a claimed job and record the transaction."""
+    claimed_at = job.locked_at
+
+    if job.invoice_id is None:
+        if job.requested_at is not None:
+            # An earlier attempt sent the request and never recorded the answer
+            _fail(db, job, claimed_at, _unknown_outcome(job, "Outcome of an earlier upstream request is unknown"))
+            return
+
+        db_merchant = crud.get_merchant(db, merchant_id=job.merchant_id)
+        if not db_merchant or not db_merchant.is_active:
+            _fail(db, job, claimed_at, "Merchant not found or not active")
+            return
+        api_key = crud.get_merchant_decrypted_api_key(db, job.merchant_id)
+        merchant_code = db_merchant.merchant_id
+
+        # Commits, so nothing is held open during the upstream call
+        if not _update_claimed(db, job, claimed_at, requested_at=datetime.now(timezone.utc)):
+            return
+
+        qris_service = qris_service or QRISService()
+        try:
+            loop = asyncio.new_event_loop()
+            try:
+                qris_result = loop.run_until_complete(
+                    qris_service.create_invoice(
+                        merchant_code,
+                        api_key,
+                        job.amount,
+                        job.description or "",
+                        client_reference=job_reference(job)
+                    )
+                )
+            finally:
+                loop.close()
+        except InvoiceNotCreated as e:
+            _retry_or_fail(db, job, claimed_at, str(e))
+            return
+        except Exception as e:
+            _fail(db, job, claimed_at, _unknown_outcome(job, f"Upstream request failed with an unknown outcome: {str(e)}"))
+            return
+
+        # Keep the provider's answer before anything else can fail
+        if not _update_claimed(
+            db, job, claimed_at,
+            invoice_id=qris_result["invoice_id"],
+            qr_code_url=qris_result.get("qr_code_url"),
+            qris_content=qris_result.get("qris_content")
+        ):
+            logger.error(f"Invoice job {job.id} lost its lease after invoice {qris_result['invoice_id']} was created upstream")
+            return
+
+    existing = crud.get_qris_transaction_by_invoice_id(db, job.invoice_id)
+    if existing is None:
+        transaction = schemas.QRISTransactionCreate(
+            merchant_id=job.merchant_id,
+            amount=job.amount,
+            description=job.description
+        )
+        # Commits the transaction row (possibly on a shard); a crash before the
+        # job is finalized is repaired on retry by the invoice_id lookup above
+        existing = crud.create_qris_transaction(
+            db=db,
+            transaction=transaction,
+            invoice_id=job.invoice_id,
+            qris_content=job.qris_content
+        )
+
+    if not _update_claimed(
+        db, job, claimed_at,
+        status="created",
+        transaction_id=existing.id,
+        locked_at=None,
+        last_error=None
+    ):
+        return
+
+    if existing.qris_content:
+        prewarm_qr_images(existing.qris_content)
+
+def run_once(batch_size: int = INVOICE_JOB_BATCH_SIZE) -> int:
+    """Claim and process up to `batch_size` jobs, one lease at a time; returns the number processed."""
+    db = SessionLocal()
+    processed = 0
+    try:
+        while processed < batch_size:
+            job = claim_job(db)
+            if job is None:
+                break
+            processed += 1
+            try:
+                process_job(db, job)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Invoice job {job.id} crashed: {str(e)}")
+        return processed
+    finally:
+        db.close()
+
+def _work_forever(stop_event: threading.Event, batch_size: int, poll_seconds: float):
+    while not stop_event.is_set():
+        try:
+            processed = run_once(batch_size)
+        except Exception as e:
+            logger.error(f"Invoice worker error: {str(e)}")
+            processed = 0
+        if not processed:
+            stop_event.wait(poll_seconds)
+
+def start_workers(
+    workers: int = INVOICE_WORKERS,
+    batch_size: int = INVOICE_JOB_BATCH_SIZE,
+    poll_seconds: float = INVOICE_JOB_POLL_SECONDS
+) -> Optional[threading.Event]:
+    """
+    Start invoice workers in daemon threads.
+
+    Returns:
+        Event that stops the workers when set, or None if workers <= 0
+    """
+    if workers <= 0:
+        return None
+
+    stop_event = threading.Event()
+    for index in range(workers):
+        threading.Thread(
+            target=_work_forever,
+            args=(stop_event, batch_size, poll_seconds),
+            name=f"invoice-worker-{index}",
+            daemon=True
+        ).start()
+    return stop_event
+
+def main():
+    """Command line entry point running a pool of invoice workers."""
+    parser = argparse.ArgumentParser(description="Process asynchronously created QRIS invoices")
+    parser.add_argument("--workers", type=int, default=max(1, INVOICE_WORKERS))
+    parser.add_argument("--batch-size", type=int, default=INVOICE_JOB_BATCH_SIZE)
+    parser.add_argument("--poll-seconds", type=float, default=INVOICE_JOB_POLL_SECONDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stop_event = start_workers(args.workers, args.batch_size, args.poll_seconds)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop_event.set()
+
+if __name__ == "__main__":
+    main()
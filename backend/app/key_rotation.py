@@ -0,0 +1,158 @@
+"""
+Re-encrypt merchant API keys with the primary encryption key.
+
+Run after adding a new key to the front of ENCRYPTION_KEYS (keeping the old
+keys after it) so every Merchant.api_key_encrypted value ends up under the
+primary key. Old keys can be dropped once the job reports nothing left to do.
+
+    python -m app.key_rotation --chunk-size 1000 --workers 4
+"""
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.fernet import InvalidToken
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+import argparse
+import logging
+
+from . import models
+from .database import SessionLocal
+from .security import is_encrypted_with_primary_key, rotate_api_key
+
+logger = logging.getLogger(__name__)
+
+def _rotate_batch(rows: List[Tuple[int, str]]) -> Tuple[List[Dict], List[int]]:
+    """
+    Re-encrypt the rows that are not yet under the primary key (runs in a worker process).
+
+    Returns:
+        The re-encrypted rows, and the ids of merchants whose key none of
+        ENCRYPTION_KEYS can decrypt (left untouched)
+    """
+    rotated = []
+    failed = []
+    for merchant_pk, encrypted_api_key in rows:
+        if is_encrypted_with_primary_key(encrypted_api_key):
+            continue
+        try:
+            new_api_key = rotate_api_key(encrypted_api_key)
+        except InvalidToken:
+            failed.append(merchant_pk)
+            continue
+        rotated.append({
+            "b_id": merchant_pk,
+            "b_old": encrypted_api_key,
+            "b_new": new_api_key
+        })
+    return rotated, failed
+
+def _split(rows: List[Tuple[int, str]], parts: int) -> List[List[Tuple[int, str]]]:
+    """Split rows into at most `parts` roughly equal batches."""
+    size = max(1, -(-len(rows) // parts))
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+def _apply_batch(db: Session, rotated: List[Dict]) -> int:
+    """Write re-encrypted keys, skipping rows whose key changed since they were read."""
+    if not rotated:
+        return 0
+
+    merchants = models.Merchant.__table__
+    stmt = update(merchants)\
+        .where(merchants.c.id == bindparam("b_id"))\
+        .where(merchants.c.api_key_encrypted == bindparam("b_old"))\
+        .values(api_key_encrypted=bindparam("b_new"))
+
+    result = db.execute(stmt, rotated)
+    db.commit()
+    return result.rowcount
+
+def reencrypt_merchant_api_keys(
+    chunk_size: int = 1000,
+    workers: int = 4,
+    start_after_id: int = 0,
+    limit: Optional[int] = None
+) -> Dict:
+    """
+    Re-encrypt all merchant API keys with the primary key.
+
+    Merchants are streamed in id order with yield_per, so memory use is bounded
+    by chunk_size. Each chunk is spread across a process pool and committed on
+    its own, with a compare-and-set on the old ciphertext so concurrent updates
+    made through the API are never overwritten. Keys that none of the
+    configured keys can decrypt are logged and counted as failed without
+    stopping the job. The job is idempotent; pass the last logged id as
+    start_after_id to resume an interrupted run.
+
+    Args:
+        chunk_size: Number of merchants read and committed per batch
+        workers: Number of worker processes doing the Fernet work
+        start_after_id: Only process merchants with a greater primary key
+        limit: Optional cap on the number of merchants scanned
+
+    Returns:
+        Dict with scanned, rotated, skipped and failed counts and the last processed id
+    """
+    read_db = SessionLocal()
+    write_db = SessionLocal()
+    stats = {"scanned": 0, "rotated": 0, "skipped": 0, "failed": 0, "last_id": start_after_id}
+
+    try:
+        rows = read_db.query(models.Merchant.id, models.Merchant.api_key_encrypted)\
+            .filter(models.Merchant.id > start_after_id)\
+            .order_by(models.Merchant.id)\
+            .yield_per(chunk_size)
+        if limit is not None:
+            rows = rows.limit(limit)
+        rows = iter(rows)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                chunk = [tuple(row) for row in islice(rows, chunk_size)]
+                if not chunk:
+                    break
+
+                rotated = []
+                failed = []
+                for batch_rotated, batch_failed in executor.map(_rotate_batch, _split(chunk, workers)):
+                    rotated.extend(batch_rotated)
+                    failed.extend(batch_failed)
+                for merchant_pk in failed:
+                    logger.error(f"Key rotation failed for merchant {merchant_pk}: no configured key decrypts its API key")
+                updated = _apply_batch(write_db, rotated)
+
+                stats["scanned"] += len(chunk)
+                stats["rotated"] += updated
+                stats["skipped"] += len(rotated) - updated
+                stats["failed"] += len(failed)
+                stats["last_id"] = chunk[-1][0]
+                logger.info(
+                    f"Key rotation progress: scanned={stats['scanned']} "
+                    f"rotated={stats['rotated']} failed={stats['failed']} last_id={stats['last_id']}"
+                )
+    finally:
+        read_db.close()
+        write_db.close()
+
+    return stats
+
+def main():
+    """Command line entry point for the key rotation job."""
+    parser = argparse.ArgumentParser(description="Re-encrypt merchant API keys with the primary encryption key")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--start-after-id", type=int, default=0)
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stats = reencrypt_merchant_api_keys(
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        start_after_id=args.start_after_id,
+        limit=args.limit
+    )
+    logger.info(f"Key rotation finished: {stats}")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -13,6 +13,8 @@ class Merchant(Base):
     merchant_id = Column(String(255), unique=True, nullable=False, index=True)
     api_key_encrypted = Column(Text, nullable=False)
     is_active = Column(Boolean, default=True)
+    invoice_ttl_minutes = Column(Integer, nullable=True)  # None uses INVOICE_TTL_MINUTES
+    shard = Column(String(50), nullable=True)  # Transaction shard (app.sharding), pinned on first use
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -31,8 +33,66 @@ class QRISTransaction(Base):
     qris_status = Column(String(50))
     payment_method = Column(String(100))
     customer_name = Column(String(255))
+    qris_content = Column(Text)  # QR payload, rendered locally by app.qr_render
+    # Incremented by every UPDATE; ETags are built from it rather than from
+    # updated_at, whose app and database clocks can't be compared
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     # Relationship
     merchant = relationship("Merchant", back_populates="transactions")
+
+    __table_args__ = (
+        # Per-merchant history and analytics range scans
+        Index("ix_qris_transactions_merchant_created_at", "merchant_id", "created_at"),
+        # Index-only count and sum(version) per merchant for list ETags
+        Index("ix_qris_transactions_merchant_version", "merchant_id", "version"),
+        # Only pending rows are ever scanned by the expiry sweeper
+        Index(
+            "ix_qris_transactions_pending_created_at",
+            "created_at",
+            postgresql_where=(status == "pending"),
+            sqlite_where=(status == "pending")
+        ),
+    )
+
+class InvoiceJob(Base):
+    """Outbox row for an invoice created asynchronously by app.invoice_worker."""
+    __tablename__ = "invoice_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    merchant_id = Column(Integer, ForeignKey("merchants.id"), nullable=False)
+    amount = Column(Integer, nullable=False)
+    description = Column(String(500))
+    status = Column(String(50), nullable=False, default="pending_creation")  # pending_creation, processing, created, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    available_at = Column(DateTime(timezone=True), server_default=func.now())
+    locked_at = Column(DateTime(timezone=True))
+    requested_at = Column(DateTime(timezone=True))  # Set before the upstream call, cleared when it certainly failed
+    invoice_id = Column(String(255))
+    qr_code_url = Column(Text)
+    qris_content = Column(Text)
+    transaction_id = Column(Integer)  # No foreign key: the row may live on another shard
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # Workers only ever look at claimable jobs
+        Index(
+            "ix_invoice_jobs_claimable",
+            "available_at",
+            postgresql_where=(status == "pending_creation"),
+            sqlite_where=(status == "pending_creation")
+        ),
+    )
+
+class InvoiceIndex(Base):
+    """Global invoice_id -> merchant lookup for sharded transactions (app.sharding)."""
+    __tablename__ = "invoice_index"
+
+    id = Column(Integer, primary_key=True)  # Also the transaction's id on its shard
+    invoice_id = Column(String(255), unique=True, nullable=False, index=True)
+    merchant_id = Column(Integer, ForeignKey("merchants.id"), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,238 @@
+"""
+On-demand request profiling.
+
+A request is profiled when it carries `X-Profile-Request: <PROFILING_ADMIN_TOKEN>`
+or is picked by PROFILING_SAMPLE_RATE. The endpoint function (DB queries,
+QRISService calls, Fernet, ...) is profiled in the threadpool thread that runs
+it, and the event-loop part (routing, response serialization) on the loop
+thread, where loop work of concurrent requests can show up too. Routers opt in
+with `APIRouter(route_class=ProfiledRoute)`; the route also times everything
+from the endpoint returning to the response being ready (response model
+validation, part of which FastAPI runs in the threadpool, and serialization)
+and reports it as `serialization` in the summary. Sync dependencies such as
+get_db run in threadpool calls of their own and are not profiled. The merged
+result is written as a pstats file to a bounded ring buffer in PROFILING_DIR
+together with a JSON summary.
+
+Only one request is profiled at a time. Requests that are not profiled pay
+for one ContextVar lookup per endpoint call.
+"""
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from fastapi.routing import APIRoute
+from typing import Dict, List, Optional
+import cProfile
+import functools
+import hmac
+import inspect
+import json
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(tempfile.gettempdir(), "monaapp_profiles"))
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "50"))
+
+PROFILE_HEADER = "x-profile-request"
+
+# Time is attributed to these components by the file path of each function,
+# or for built-ins (C/Rust extensions, filename "~") by their qualified name
+COMPONENTS = {
+    "qris_service": "app/qris_service.py",
+    "sqlalchemy": "sqlalchemy",
+    "fernet": "cryptography",
+    "pydantic": "pydantic",
+}
+
+class ProfileSession:
+    """Profiles collected for one request, one per thread that did work for it."""
+
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        # perf_counter() when the endpoint returned, and the time from then
+        # until the route produced its response
+        self.endpoint_finished: Optional[float] = None
+        self.serialization: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def new_profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+_current_session: ContextVar[Optional[ProfileSession]] = ContextVar("profile_session", default=None)
+_active_lock = threading.Lock()
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """Check a token against PROFILING_ADMIN_TOKEN (always False when unset)."""
+    if not PROFILING_ADMIN_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), PROFILING_ADMIN_TOKEN.encode())
+
+def _profiled(call):
+    """Wrap a sync endpoint so it is profiled when its request is being profiled."""
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        session = _current_session.get()
+        if session is None:
+            return call(*args, **kwargs)
+        profile = session.new_profile()
+        profile.enable()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profile.disable()
+            session.endpoint_finished = time.perf_counter()
+    return wrapper
+
+class ProfiledRoute(APIRoute):
+    """API route whose sync endpoint and response serialization are covered by on-demand profiling."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The request handler looks the endpoint up on the dependant per call
+        if self.dependant.call is not None and not inspect.iscoroutinefunction(self.dependant.call):
+            self.dependant.call = _profiled(self.dependant.call)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            response = await handler(request)
+            session = _current_session.get()
+            if session is not None and session.endpoint_finished is not None:
+                session.serialization = time.perf_counter() - session.endpoint_finished
+            return response
+
+        return profiled_handler
+
+def _should_profile(request) -> bool:
+    if is_admin_token(request.headers.get(PROFILE_HEADER)):
+        return True
+    return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+def _component_of(function) -> Optional[str]:
+    filename, _, name = function
+    location = (name if filename == "~" else filename).replace(os.sep, "/")
+    for component, marker in COMPONENTS.items():
+        if marker in location:
+            return component
+    return None
+
+def _component_times(stats: pstats.Stats) -> Dict[str, float]:
+    """
+    Cumulative time per component, in seconds.
+
+    Time is taken at each component's entry frames (a function of the
+    component called from outside it), so built-ins it calls into count too,
+    and nested calls inside the component are not counted twice.
+    """
+    totals = {name: 0.0 for name in COMPONENTS}
+    for function, (_, _, _, cumtime, callers) in stats.stats.items():
+        component = _component_of(function)
+        if component is None:
+            continue
+        if not callers:
+            totals[component] += cumtime
+            continue
+        for caller, caller_stats in callers.items():
+            if _component_of(caller) != component:
+                totals[component] += caller_stats[3]
+    return {name: round(value, 6) for name, value in totals.items()}
+
+def _write_profile(session: ProfileSession, request, status_code: int, duration: float) -> Optional[str]:
+    profiles = [profile for profile in session.profiles if profile.getstats()]
+    if not profiles:
+        return None
+
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    created_at = datetime.now(timezone.utc)
+    profile_id = f"{created_at.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+    stats.dump_stats(os.path.join(PROFILING_DIR, f"{profile_id}.pstats"))
+
+    summary = {
+        "id": profile_id,
+        "created_at": created_at.isoformat(),
+        "method": request.method,
+        "path": request.url.path,
+        "status_code": status_code,
+        "duration": round(duration, 6),
+        "components": _component_times(stats),
+        "serialization": round(session.serialization, 6) if session.serialization is not None else None
+    }
+    with open(os.path.join(PROFILING_DIR, f"{profile_id}.json"), "w") as f:
+        json.dump(summary, f)
+
+    _trim_ring_buffer()
+    return profile_id
+
+def _trim_ring_buffer():
+    """Delete the oldest profiles beyond PROFILING_MAX_FILES."""
+    ids = sorted(name[:-len(".json")] for name in os.listdir(PROFILING_DIR) if name.endswith(".json"))
+    for profile_id in ids[:-PROFILING_MAX_FILES] if len(ids) > PROFILING_MAX_FILES else []:
+        for extension in (".json", ".pstats"):
+            try:
+                os.remove(os.path.join(PROFILING_DIR, profile_id + extension))
+            except OSError:
+                pass
+
+def list_profiles() -> List[Dict]:
+    """Summaries of stored profiles, newest first."""
+    if not os.path.isdir(PROFILING_DIR):
+        return []
+    summaries = []
+    for name in sorted(os.listdir(PROFILING_DIR), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILING_DIR, name)) as f:
+                summaries.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return summaries
+
+def get_profile_path(profile_id: str) -> Optional[str]:
+    """Path of a stored pstats file, or None if it doesn't exist."""
+    if os.path.basename(profile_id) != profile_id:
+        return None
+    path = os.path.join(PROFILING_DIR, f"{profile_id}.pstats")
+    return path if os.path.isfile(path) else None
+
+async def profiling_middleware(request, call_next):
+    """Profile the request if it asked for it or was sampled."""
+    if not _should_profile(request) or not _active_lock.acquire(blocking=False):
+        return await call_next(request)
+
+    session = ProfileSession()
+    token = _current_session.set(session)
+    loop_profile = session.new_profile()
+    started = time.perf_counter()
+    loop_profile.enable()
+    try:
+        response = await call_next(request)
+    finally:
+        loop_profile.disable()
+        _current_session.reset(token)
+        _active_lock.release()
+
+    try:
+        profile_id = _write_profile(session, request, response.status_code, time.perf_counter() - started)
+        if profile_id:
+            response.headers["X-Profile-Id"] = profile_id
+    except Exception as e:
+        logger.error(f"Failed to write request profile: {str(e)}")
+    return response
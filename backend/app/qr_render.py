@@ -0,0 +1,146 @@
+"""
+Local QR code rendering for QRIS payloads.
+
+Images are content-addressed by a hash of (payload, format, size) and cached
+in a memory LRU in front of an on-disk directory, so each QR is rendered once
+and then served from memory or disk.
+"""
+from collections import OrderedDict
+from io import BytesIO
+from typing import Optional, Tuple
+import hashlib
+import os
+import tempfile
+import threading
+import logging
+
+import qrcode
+import qrcode.image.svg
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "monaapp_qr_cache"))
+QR_MEMORY_CACHE_BYTES = int(os.getenv("QR_MEMORY_CACHE_BYTES", str(32 * 1024 * 1024)))
+QR_DEFAULT_SIZE = int(os.getenv("QR_DEFAULT_SIZE", "300"))
+QR_MIN_SIZE = 64
+QR_MAX_SIZE = 1024
+
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+# Bump when rendering changes so old cache entries are not served
+RENDER_VERSION = "2"
+
+class QRImageCache:
+    """Memory LRU (bounded by total bytes) backed by a directory of files."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        self._remember(key, data)
+        return data
+
+    def set(self, key: str, data: bytes):
+        self._remember(key, data)
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write QR cache file {path}: {str(e)}")
+
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+qr_cache = QRImageCache(QR_CACHE_DIR, QR_MEMORY_CACHE_BYTES)
+
+def clamp_size(size: Optional[int]) -> int:
+    """Clamp a requested pixel size to the supported range."""
+    return max(QR_MIN_SIZE, min(QR_MAX_SIZE, size or QR_DEFAULT_SIZE))
+
+def qr_cache_key(payload: str, image_format: str, size: int) -> str:
+    """Content address of a rendered QR image (SVG is scalable, so size is ignored)."""
+    size_part = "" if image_format == "svg" else str(size)
+    digest = hashlib.sha256(f"{RENDER_VERSION}|{image_format}|{size_part}|{payload}".encode()).hexdigest()
+    return f"{digest}.{image_format}"
+
+def _render(payload: str, image_format: str, size: int) -> bytes:
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    buffer = BytesIO()
+    if image_format == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+        return buffer.getvalue()
+
+    # Whole pixels per module, padded with white up to `size`: resampling
+    # would make modules uneven or drop them and corrupt dense codes. Codes
+    # with more modules than `size` pixels are returned at one pixel per module.
+    modules = qr.modules_count + 2 * qr.border
+    qr.box_size = max(1, size // modules)
+    image = qr.make_image(fill_color="black", back_color="white").get_image()
+    if image.size[0] < size:
+        padded = Image.new(image.mode, (size, size), "white")
+        offset = (size - image.size[0]) // 2
+        padded.paste(image, (offset, offset))
+        image = padded
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def get_qr_image(payload: str, image_format: str = "png", size: Optional[int] = None) -> Tuple[str, bytes]:
+    """
+    Get a rendered QR image, rendering and caching it on a miss.
+
+    Returns:
+        Tuple of (content-addressed cache key, image bytes)
+    """
+    size = clamp_size(size)
+    key = qr_cache_key(payload, image_format, size)
+
+    data = qr_cache.get(key)
+    if data is None:
+        data = _render(payload, image_format, size)
+        qr_cache.set(key, data)
+    return key, data
+
+def prewarm_qr_images(payload: str):
+    """Render the default PNG and the SVG so the first fetch is a cache hit."""
+    try:
+        get_qr_image(payload, "png")
+        get_qr_image(payload, "svg")
+    except Exception as e:
+        logger.error(f"Failed to pre-render QR image: {str(e)}")
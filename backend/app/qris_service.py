@@ -1,17 +1,55 @@
 import requests
 import os
+import time
 from typing import Dict, Optional
 from datetime import datetime
+from urllib3.exceptions import NewConnectionError
 import logging
 
+from .concurrency import record_upstream_call
+
 logger = logging.getLogger(__name__)
 
+QRIS_TIMEOUT_SECONDS = 30
+
+class InvoiceNotCreated(Exception):
+    """The provider certainly did not create the invoice (it rejected it, or the request never reached it)."""
+
+def _request_not_delivered(e: requests.exceptions.RequestException) -> bool:
+    """Whether a failed create request certainly left nothing behind upstream."""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is not None and e.response.status_code < 500
+    if isinstance(e, requests.exceptions.ConnectionError):
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        return isinstance(reason, NewConnectionError)
+    return False
+
 class QRISService:
     def __init__(self):
         self.base_url = os.getenv("QRIS_API_BASE_URL", "https://qris.interactive.co.id/restapi/qris")
-        self.timeout = 30
+        self.timeout = QRIS_TIMEOUT_SECONDS
 
-    async def create_invoice(self, merchant_id: str, api_key: str, amount: int, description: str = "") -> Dict:
+    def _get(self, url: str, params: Dict) -> requests.Response:
+        """GET from the provider, recording latency and failures for load shedding and /ready."""
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = requests.get(url, params=params, timeout=self.timeout)
+            ok = response.status_code < 500
+            return response
+        finally:
+            record_upstream_call(time.perf_counter() - started, ok)
+
+    async def create_invoice(
+        self,
+        merchant_id: str,
+        api_key: str,
+        amount: int,
+        description: str = "",
+        client_reference: Optional[str] = None
+    ) -> Dict:
         """
         Create a QRIS invoice using the QRIS API.
         
@@ -20,9 +58,14 @@ class QRISService:
             api_key: The API key from QRIS provider
             amount: Transaction amount in Rupiah
             description: Optional transaction description
+            client_reference: Optional stable cliTrxNumber, so retries reuse the same reference
             
         Returns:
-            Dict containing invoice_id and qr_code_url
+            Dict containing invoice_id, qr_code_url and qris_content (the QR payload)
+
+        Raises:
+            InvoiceNotCreated: If the provider certainly did not create the
+                invoice; any other exception leaves that unknown
         """
         try:
             # Use GET method for simulator, POST for production
@@ -32,14 +75,14 @@ class QRISService:
                 "do": "create-invoice",
                 "apikey": api_key,
                 "mID": merchant_id,
-                "cliTrxNumber": f"INV{datetime.now().strftime('%Y%m%d%H%M%S')}",
+                "cliTrxNumber": client_reference or f"INV{datetime.now().strftime('%Y%m%d%H%M%S')}",
                 "cliTrxAmount": str(amount),
                 "cliTrxDescription": description or "Payment via QRIS"
             }
             
             logger.info(f"Creating QRIS invoice for amount: {amount}")
             
-            response = requests.get(url, params=params, timeout=self.timeout)
+            response = self._get(url, params)
             response.raise_for_status()
             
             data = response.json()
@@ -47,21 +90,24 @@ class QRISService:
             if data.get("status") == "success":
                 return {
                     "invoice_id": data["data"]["qris_invoiceid"],
-                    "qr_code_url": data["data"]["qris_qrcode"],
+                    "qr_code_url": data["data"].get("qris_qrcode"),
+                    "qris_content": data["data"].get("qris_content"),
                     "amount": amount,
                     "status": "created"
                 }
             else:
                 error_msg = data.get("message", "Unknown error from QRIS API")
                 logger.error(f"QRIS API error: {error_msg}")
-                raise Exception(f"QRIS API Error: {error_msg}")
+                raise InvoiceNotCreated(f"QRIS API Error: {error_msg}")
                 
         except requests.exceptions.RequestException as e:
             logger.error(f"Request error creating QRIS invoice: {str(e)}")
-            raise Exception(f"Network error: {str(e)}")
+            error = InvoiceNotCreated if _request_not_delivered(e) else Exception
+            raise error(f"Network error: {str(e)}")
         except Exception as e:
             logger.error(f"Error creating QRIS invoice: {str(e)}")
-            raise Exception(f"Failed to create QRIS invoice: {str(e)}")
+            error = InvoiceNotCreated if isinstance(e, InvoiceNotCreated) else Exception
+            raise error(f"Failed to create QRIS invoice: {str(e)}")
 
     async def check_payment_status(self, merchant_id: str, api_key: str, invoice_id: str, amount: int) -> Dict:
         """
@@ -90,7 +136,7 @@ class QRISService:
             
             logger.info(f"Checking QRIS payment status for invoice: {invoice_id}")
             
-            response = requests.get(url, params=params, timeout=self.timeout)
+            response = self._get(url, params)
             response.raise_for_status()
             
             data = response.json()
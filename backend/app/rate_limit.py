@@ -0,0 +1,190 @@
+"""
+Token-bucket rate limiting for routes that call the QRIS provider.
+
+Buckets live in process memory by default. Set RATE_LIMIT_REDIS_URL to share
+them across workers and instances (requires the `redis` package).
+"""
+from abc import ABC, abstractmethod
+from fastapi import HTTPException, status
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+import math
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rates are tokens per second, bursts are bucket capacities
+MERCHANT_RATE = float(os.getenv("RATE_LIMIT_MERCHANT_RATE", "2"))
+MERCHANT_BURST = int(os.getenv("RATE_LIMIT_MERCHANT_BURST", "10"))
+GLOBAL_RATE = float(os.getenv("RATE_LIMIT_GLOBAL_RATE", "50"))
+GLOBAL_BURST = int(os.getenv("RATE_LIMIT_GLOBAL_BURST", "100"))
+REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+
+class Bucket(NamedTuple):
+    """A token bucket: its key, refill rate (tokens per second) and capacity."""
+    key: str
+    rate: float
+    burst: int
+
+class RateLimitBackend(ABC):
+    """Storage for token buckets."""
+
+    @abstractmethod
+    def acquire(self, buckets: Sequence[Bucket]) -> Tuple[Optional[Bucket], float]:
+        """
+        Take one token from every bucket, or from none of them.
+
+        Returns:
+            Tuple of (first empty bucket or None if the tokens were taken,
+            seconds until that bucket has a token)
+        """
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Per-process token buckets guarded by a lock."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> (tokens, updated, rate, burst)
+        self._buckets: Dict[str, Tuple[float, float, float, int]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, buckets: Sequence[Bucket]) -> Tuple[Optional[Bucket], float]:
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for bucket in buckets:
+                tokens, updated, _, _ = self._buckets.get(bucket.key, (bucket.burst, now, bucket.rate, bucket.burst))
+                levels.append(min(bucket.burst, tokens + (now - updated) * bucket.rate))
+
+            empty = next((index for index, tokens in enumerate(levels) if tokens < 1), None)
+            taken = 0 if empty is not None else 1
+            for bucket, tokens in zip(buckets, levels):
+                self._buckets[bucket.key] = (tokens - taken, now, bucket.rate, bucket.burst)
+
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+
+        if empty is None:
+            return None, 0.0
+        return buckets[empty], (1 - levels[empty]) / buckets[empty].rate
+
+    def _prune(self, now: float):
+        """Drop buckets that have refilled completely, they behave like new ones."""
+        idle = [
+            key for key, (tokens, updated, rate, burst) in self._buckets.items()
+            if tokens + (now - updated) * rate >= burst
+        ]
+        for key in idle:
+            del self._buckets[key]
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Token buckets shared through Redis, updated atomically with a Lua script."""
+
+    SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local levels = {}
+    local empty = 0
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[2 * i])
+        local burst = tonumber(ARGV[2 * i + 1])
+        local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        levels[i] = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        if empty == 0 and levels[i] < 1 then
+            empty = i
+        end
+    end
+    local taken = 1
+    if empty > 0 then
+        taken = 0
+    end
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[2 * i])
+        local burst = tonumber(ARGV[2 * i + 1])
+        redis.call('HSET', key, 'tokens', levels[i] - taken, 'updated', now)
+        redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+    end
+    if empty == 0 then
+        return {0, '0'}
+    end
+    return {empty, tostring(levels[empty])}
+    """
+
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def acquire(self, buckets: Sequence[Bucket]) -> Tuple[Optional[Bucket], float]:
+        args = [time.time()]
+        for bucket in buckets:
+            args.extend([bucket.rate, bucket.burst])
+        empty, tokens = self._script(keys=[f"ratelimit:{bucket.key}" for bucket in buckets], args=args)
+        if not empty:
+            return None, 0.0
+        bucket = buckets[empty - 1]
+        return bucket, (1 - float(tokens)) / bucket.rate
+
+class RateLimiter:
+    """Applies per-merchant and global buckets and keeps counters."""
+
+    def __init__(self, backend: RateLimitBackend):
+        self.backend = backend
+        self._counters: Dict[str, int] = {"allowed": 0, "rejected_merchant": 0, "rejected_global": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def check(self, keys: Dict[str, str], include_global: bool = True):
+        """
+        Take a token from the bucket of each scope -> key in `keys` and,
+        optionally, from the global bucket.
+
+        Tokens are only taken when every bucket has one, so a request
+        rejected by one bucket isn't charged by the others.
+
+        Raises:
+            HTTPException: 429 with a Retry-After header when a bucket is empty
+        """
+        buckets = [Bucket(f"{scope}:{key}", MERCHANT_RATE, MERCHANT_BURST) for scope, key in keys.items()]
+        if include_global:
+            buckets.append(Bucket("global", GLOBAL_RATE, GLOBAL_BURST))
+
+        empty, retry_after = self.backend.acquire(buckets)
+        if empty is not None:
+            self._count("rejected_global" if empty.key == "global" else "rejected_merchant")
+            self._reject(retry_after)
+
+        self._count("allowed")
+
+    def _reject(self, retry_after: float):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    def stats(self) -> Dict:
+        """Return limiter counters and configuration."""
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "backend": type(self.backend).__name__,
+            "merchant": {"rate": MERCHANT_RATE, "burst": MERCHANT_BURST},
+            "global": {"rate": GLOBAL_RATE, "burst": GLOBAL_BURST},
+            "counters": counters
+        }
+
+def _create_backend() -> RateLimitBackend:
+    if REDIS_URL:
+        logger.info("Using Redis rate limit backend")
+        return RedisRateLimitBackend(REDIS_URL)
+    return InMemoryRateLimitBackend()
+
+rate_limiter = RateLimiter(_create_backend())
@@ -0,0 +1,61 @@
+"""
+Readiness report for load balancers.
+
+An instance is ready while its database pools have free connections, the
+QRIS provider has been answering within bounds and the adaptive concurrency
+limiter isn't saturated. Everything is read from in-process counters, so the
+probe stays fast even when the pool is exhausted.
+"""
+from sqlalchemy.pool import QueuePool
+from typing import Dict, Optional
+import os
+
+from .concurrency import upstream_limiter, upstream_stats
+from .database import DB_MAX_OVERFLOW, engine
+from .sharding import shard_engines
+
+READY_MIN_POOL_HEADROOM = int(os.getenv("READY_MIN_POOL_HEADROOM", "1"))
+READY_MAX_UPSTREAM_ERROR_RATE = float(os.getenv("READY_MAX_UPSTREAM_ERROR_RATE", "0.5"))
+READY_MAX_UPSTREAM_P95_MS = float(os.getenv("READY_MAX_UPSTREAM_P95_MS", "10000"))
+READY_MAX_LIMITER_SATURATION = float(os.getenv("READY_MAX_LIMITER_SATURATION", "0.95"))
+# Upstream figures are only judged once the window has this many calls
+READY_MIN_UPSTREAM_CALLS = int(os.getenv("READY_MIN_UPSTREAM_CALLS", "10"))
+
+def pool_status(pool_engine) -> Optional[Dict]:
+    """Checked-out connections and headroom of a QueuePool, or None for other pool types."""
+    pool = pool_engine.pool
+    if not isinstance(pool, QueuePool):
+        return None
+    # Engines are created with DB_MAX_OVERFLOW (app.database.pool_options)
+    capacity = pool.size() + max(0, DB_MAX_OVERFLOW)
+    checked_out = pool.checkedout()
+    return {"size": capacity, "checked_out": checked_out, "headroom": capacity - checked_out}
+
+def readiness_report() -> Dict:
+    """Collect readiness checks; `ready` is False if any of them fails."""
+    failures = []
+
+    pools = {"primary": pool_status(engine)}
+    pools.update({f"shard:{name}": pool_status(shard_engine) for name, shard_engine in shard_engines.items()})
+    for name, pool in pools.items():
+        if pool is not None and pool["headroom"] < READY_MIN_POOL_HEADROOM:
+            failures.append(f"database pool {name} exhausted")
+
+    upstream = upstream_stats.snapshot()
+    if upstream["calls"] >= READY_MIN_UPSTREAM_CALLS:
+        if upstream["error_rate"] > READY_MAX_UPSTREAM_ERROR_RATE:
+            failures.append("upstream error rate too high")
+        if upstream["p95_ms"] > READY_MAX_UPSTREAM_P95_MS:
+            failures.append("upstream latency too high")
+
+    limiter = upstream_limiter.stats()
+    if limiter["saturation"] >= READY_MAX_LIMITER_SATURATION:
+        failures.append("concurrency limit saturated")
+
+    return {
+        "ready": not failures,
+        "failures": failures,
+        "database_pools": pools,
+        "upstream": upstream,
+        "concurrency": limiter
+    }
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import FileResponse
+from typing import Optional
+from ..profiling import ProfiledRoute, is_admin_token, list_profiles, get_profile_path
+
+router = APIRouter(prefix="/api/admin", tags=["admin"], route_class=ProfiledRoute)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Require the X-Admin-Token header to match PROFILING_ADMIN_TOKEN."""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin token required"
+        )
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+def get_profiles():
+    """List stored request profiles, newest first."""
+    return {"profiles": list_profiles()}
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def download_profile(profile_id: str):
+    """Download a stored request profile in pstats format."""
+    path = get_profile_path(profile_id)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.pstats")
@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import JSONResponse, StreamingResponse
+import codecs
+import json
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from .. import crud, schemas, models
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..qris_service import QRISService
+from ..concurrency import upstream_limiter
+from ..bulk_import import detect_format, encryption_pool, import_merchants
+from ..fieldsets import parse_fields, rows_to_dicts
+from ..etag import make_etag, etag_matches, not_modified, set_etag
+from ..profiling import ProfiledRoute
 
-router = APIRouter(prefix="/api/merchants", tags=["merchants"])
+router = APIRouter(prefix="/api/merchants", tags=["merchants"], route_class=ProfiledRoute)
 
 @router.post("/", response_model=schemas.MerchantResponse)
 def create_merchant(merchant: schemas.MerchantCreate, db: Session = Depends(get_db)):
@@ -20,20 +28,73 @@ def create_merchant(merchant: schemas.MerchantCreate, db: Session = Depends(get_
     
     return crud.create_merchant(db=db, merchant=merchant)
 
+@router.post("/bulk-import")
+def bulk_import_merchants(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    batch_size: int = Query(1000, ge=1, le=10000),
+    on_conflict: str = Query("update", pattern="^(update|skip)$")
+):
+    """
+    Bulk import merchants from a CSV or NDJSON upload.
+
+    Streams NDJSON events back: an "error" per rejected row, a "progress"
+    event per inserted batch and a final "done" event with the totals.
+    """
+    file_format = format or detect_format(file.filename)
+    lines = codecs.getreader("utf-8")(file.file)
+
+    def events():
+        for event in import_merchants(
+            lines,
+            file_format=file_format,
+            batch_size=batch_size,
+            executor=encryption_pool(),
+            on_conflict=on_conflict
+        ):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 @router.get("/", response_model=schemas.MerchantListResponse)
-def get_merchants(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_merchants(
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[str] = Query(None, description="Comma-separated merchant fields to return"),
+    db: Session = Depends(get_read_db)
+):
     """Get all merchants with pagination."""
-    merchants = crud.get_merchants(db, skip=skip, limit=limit)
+    selected = parse_fields(fields, schemas.MerchantResponse)
+    merchants = crud.get_merchants(db, skip=skip, limit=limit, fields=selected)
     total = len(merchants)  # In a real app, you'd want a separate count query
     
+    if selected:
+        # Partial rows don't fit the response model, serialize them directly
+        return JSONResponse({
+            "merchants": rows_to_dicts(merchants),
+            "total": total
+        })
+    
     return {
         "merchants": merchants,
         "total": total
     }
 
 @router.get("/{merchant_id}", response_model=schemas.MerchantResponse)
-def get_merchant(merchant_id: int, db: Session = Depends(get_db)):
+def get_merchant(
+    merchant_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db)
+):
     """Get a specific merchant by ID."""
+    updated_at = crud.get_merchant_updated_at(db, merchant_id=merchant_id)
+    if updated_at is not None:
+        etag = make_etag("merchant", merchant_id, updated_at)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+    
     db_merchant = crud.get_merchant(db, merchant_id=merchant_id)
     if db_merchant is None:
         raise HTTPException(
@@ -68,7 +129,10 @@ def delete_merchant(merchant_id: int, db: Session = Depends(get_db)):
         )
     return {"message": "Merchant deleted successfully"}
 
-@router.post("/{merchant_id}/test-connection")
+@router.post(
+    "/{merchant_id}/test-connection",
+    dependencies=[Depends(upstream_limiter.admit)]
+)
 def test_merchant_connection(merchant_id: int, db: Session = Depends(get_db)):
     """Test the connection to QRIS API for a specific merchant."""
     # Get merchant and decrypt API key
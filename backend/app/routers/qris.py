@@ -1,18 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 from .. import crud, schemas, models
-from ..database import get_db
+from ..database import get_db, get_read_db, is_replica_session, replica_monitor
 from ..qris_service import QRISService
+from ..rate_limit import rate_limiter
+from ..concurrency import upstream_limiter
+from ..qr_render import MEDIA_TYPES, get_qr_image, prewarm_qr_images
+from ..fieldsets import parse_fields, rows_to_dicts
+from ..etag import make_etag, etag_matches, not_modified, set_etag
+from ..profiling import ProfiledRoute
+from ..analytics import get_transaction_analytics
+from ..invoice_expiry import is_transaction_expired, expire_transaction
 
-router = APIRouter(prefix="/api/qris", tags=["qris"])
+router = APIRouter(prefix="/api/qris", tags=["qris"], route_class=ProfiledRoute)
 
-@router.post("/create-invoice", response_model=schemas.QRISInvoiceResponse)
+@router.post(
+    "/create-invoice",
+    response_model=schemas.QRISInvoiceResponse,
+    dependencies=[Depends(upstream_limiter.admit)]
+)
 def create_qris_invoice(
     transaction: schemas.QRISTransactionCreate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """Create a QRIS invoice for payment."""
+    rate_limiter.check({"merchant": str(transaction.merchant_id)})
+
     # Get merchant and decrypt API key
     db_merchant = crud.get_merchant(db, merchant_id=transaction.merchant_id)
     if not db_merchant:
@@ -57,12 +74,20 @@ def create_qris_invoice(
         db_transaction = crud.create_qris_transaction(
             db=db,
             transaction=transaction,
-            invoice_id=qris_result["invoice_id"]
+            invoice_id=qris_result["invoice_id"],
+            qris_content=qris_result.get("qris_content")
         )
         
+        qr_image_url = None
+        if db_transaction.qris_content:
+            qr_image_url = f"{router.prefix}/invoices/{db_transaction.invoice_id}/qr"
+            # Render after the response is sent so the first image fetch is a cache hit
+            background_tasks.add_task(prewarm_qr_images, db_transaction.qris_content)
+        
         return {
             "invoice_id": qris_result["invoice_id"],
-            "qr_code_url": qris_result["qr_code_url"],
+            "qr_code_url": qris_result["qr_code_url"] or qr_image_url or "",
+            "qr_image_url": qr_image_url,
             "amount": transaction.amount,
             "status": "created"
         }
@@ -73,7 +98,95 @@ def create_qris_invoice(
             detail=f"Failed to create QRIS invoice: {str(e)}"
         )
 
-@router.get("/check-status/{invoice_id}", response_model=schemas.QRISStatusResponse)
+def _invoice_job_response(db_job: models.InvoiceJob) -> dict:
+    qr_image_url = None
+    if db_job.invoice_id:
+        qr_image_url = f"{router.prefix}/invoices/{db_job.invoice_id}/qr"
+    return {
+        "job_id": db_job.id,
+        "status": db_job.status,
+        "attempts": db_job.attempts,
+        "last_error": db_job.last_error,
+        "invoice_id": db_job.invoice_id,
+        "qr_code_url": db_job.qr_code_url,
+        "qr_image_url": qr_image_url,
+        "created_at": db_job.created_at,
+        "updated_at": db_job.updated_at
+    }
+
+@router.post(
+    "/invoice-jobs",
+    response_model=schemas.InvoiceJobResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+def create_qris_invoice_job(
+    transaction: schemas.QRISTransactionCreate,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """Queue a QRIS invoice for asynchronous creation by the invoice workers."""
+    rate_limiter.check({"merchant": str(transaction.merchant_id)})
+
+    db_merchant = crud.get_merchant(db, merchant_id=transaction.merchant_id)
+    if not db_merchant:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Merchant not found"
+        )
+    
+    if not db_merchant.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Merchant is not active"
+        )
+    
+    db_job = crud.create_invoice_job(db, transaction)
+    response.headers["Location"] = f"{router.prefix}/invoice-jobs/{db_job.id}"
+    return _invoice_job_response(db_job)
+
+@router.get("/invoice-jobs/{job_id}", response_model=schemas.InvoiceJobResponse)
+def get_qris_invoice_job(job_id: int, db: Session = Depends(get_db)):
+    """Get the state of an asynchronously created invoice."""
+    db_job = crud.get_invoice_job(db, job_id=job_id)
+    if db_job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Invoice job not found"
+        )
+    return _invoice_job_response(db_job)
+
+@router.get("/invoices/{invoice_id}/qr")
+def get_qris_invoice_qr(
+    invoice_id: str,
+    request: Request,
+    format: str = Query("png", pattern="^(png|svg)$"),
+    size: Optional[int] = Query(None, ge=64, le=1024),
+    db: Session = Depends(get_read_db),
+    primary_db: Session = Depends(get_db)
+):
+    """Render the invoice's QRIS payload as a PNG or SVG image."""
+    db_transaction = crud.get_qris_transaction_by_invoice_id(db, invoice_id)
+    if db_transaction is None and is_replica_session(db):
+        # Fetched right after create-invoice, the row may not have reached the replica yet
+        db_transaction = crud.get_qris_transaction_by_invoice_id(primary_db, invoice_id)
+    if db_transaction is None or not db_transaction.qris_content:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="QR code not found"
+        )
+    
+    key, image = get_qr_image(db_transaction.qris_content, format, size)
+    # An invoice's payload never changes, so the image can be cached forever
+    headers = {"ETag": f'"{key}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=image, media_type=MEDIA_TYPES[format], headers=headers)
+
+@router.get(
+    "/check-status/{invoice_id}",
+    response_model=schemas.QRISStatusResponse,
+    dependencies=[Depends(upstream_limiter.admit)]
+)
 def check_qris_status(invoice_id: str, db: Session = Depends(get_db)):
     """Check the payment status of a QRIS invoice."""
     # Get transaction from database
@@ -84,6 +197,14 @@ def check_qris_status(invoice_id: str, db: Session = Depends(get_db)):
             detail="Transaction not found"
         )
     
+    # Throttle polling of the invoice (keyed on the stored transaction, so
+    # unknown ids don't create buckets) and the merchant bucket shared with
+    # create-invoice
+    rate_limiter.check({
+        "invoice": str(db_transaction.id),
+        "merchant": str(db_transaction.merchant_id)
+    })
+    
     # Get merchant and decrypt API key
     db_merchant = crud.get_merchant(db, merchant_id=db_transaction.merchant_id)
     if not db_merchant:
@@ -92,6 +213,16 @@ def check_qris_status(invoice_id: str, db: Session = Depends(get_db)):
             detail="Merchant not found"
         )
     
+    # Expired invoices can no longer be paid, so skip the upstream check
+    if is_transaction_expired(db_transaction, db_merchant):
+        if db_transaction.status != "expired":
+            expire_transaction(db, db_transaction)
+        return {
+            "qris_status": "expired",
+            "qris_payment_customername": db_transaction.customer_name,
+            "qris_payment_methodby": db_transaction.payment_method
+        }
+    
     api_key = crud.get_merchant_decrypted_api_key(db, db_transaction.merchant_id)
     if not api_key:
         raise HTTPException(
@@ -137,23 +268,44 @@ def check_qris_status(invoice_id: str, db: Session = Depends(get_db)):
 
 @router.get("/transactions", response_model=schemas.QRISTransactionListResponse)
 def get_qris_transactions(
+    request: Request,
+    response: Response,
     merchant_id: int,
     page: int = 1,
     limit: int = 20,
-    db: Session = Depends(get_db)
+    fields: Optional[str] = Query(None, description="Comma-separated transaction fields to return"),
+    db: Session = Depends(get_read_db)
 ):
     """Get QRIS transactions for a specific merchant with pagination."""
     skip = (page - 1) * limit
+    selected = parse_fields(fields, schemas.QRISTransactionResponse)
+    
+    # Count and sum(version) change whenever any of the merchant's rows do
+    total, versions = crud.get_transactions_version_by_merchant(db, merchant_id)
+    etag = make_etag("transactions", merchant_id, page, limit, selected, total, versions)
+    if etag_matches(request, etag):
+        return not_modified(etag)
     
     transactions = crud.get_qris_transactions_by_merchant(
         db, 
         merchant_id=merchant_id, 
         skip=skip, 
-        limit=limit
+        limit=limit,
+        fields=selected
     )
     
-    total = crud.get_transactions_count_by_merchant(db, merchant_id)
+    if selected:
+        # Partial rows don't fit the response model, serialize them directly
+        response = JSONResponse({
+            "transactions": rows_to_dicts(transactions),
+            "total": total,
+            "page": page,
+            "limit": limit
+        })
+        set_etag(response, etag)
+        return response
     
+    set_etag(response, etag)
     return {
         "transactions": transactions,
         "total": total,
@@ -161,9 +313,46 @@ def get_qris_transactions(
         "limit": limit
     }
 
+@router.get("/analytics", response_model=schemas.TransactionAnalyticsResponse)
+def get_qris_analytics(
+    merchant_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bins: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_read_db)
+):
+    """Get amount distribution, hourly heatmap and payment-method breakdown of paid transactions."""
+    db_merchant = crud.get_merchant(db, merchant_id=merchant_id)
+    if db_merchant is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Merchant not found"
+        )
+
+    return get_transaction_analytics(db, merchant_id, start=start, end=end, bins=bins)
+
 @router.get("/transactions/{transaction_id}", response_model=schemas.QRISTransactionResponse)
-def get_qris_transaction(transaction_id: int, db: Session = Depends(get_db)):
+def get_qris_transaction(
+    transaction_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
+    primary_db: Session = Depends(get_db)
+):
     """Get a specific QRIS transaction by ID."""
+    version = crud.get_qris_transaction_version(db, transaction_id=transaction_id)
+    if is_replica_session(db) and (version is None or replica_monitor.has_recent_write(version[0])):
+        # The row may not have reached the replica yet, or its merchant
+        # wrote through this process within the read-your-writes window
+        db = primary_db
+        version = crud.get_qris_transaction_version(db, transaction_id=transaction_id)
+    
+    if version is not None:
+        etag = make_etag("transaction", transaction_id, version[1])
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+    
     db_transaction = crud.get_qris_transaction(db, transaction_id=transaction_id)
     if db_transaction is None:
         raise HTTPException(
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 # Merchant Schemas
@@ -9,19 +9,21 @@ class MerchantBase(BaseModel):
     api_key: str = Field(..., min_length=1)
 
 class MerchantCreate(MerchantBase):
-    pass
+    invoice_ttl_minutes: Optional[int] = Field(None, gt=0)
 
 class MerchantUpdate(BaseModel):
     name: Optional[str] = Field(None, min_length=1, max_length=255)
     merchant_id: Optional[str] = Field(None, min_length=1, max_length=255)
     api_key: Optional[str] = Field(None, min_length=1)
     is_active: Optional[bool] = None
+    invoice_ttl_minutes: Optional[int] = Field(None, gt=0)
 
 class MerchantResponse(BaseModel):
     id: int
     name: str
     merchant_id: str
     is_active: bool
+    invoice_ttl_minutes: Optional[int] = None
     created_at: datetime
     updated_at: datetime
 
@@ -67,14 +69,59 @@ class QRISTransactionListResponse(BaseModel):
 class QRISInvoiceResponse(BaseModel):
     invoice_id: str
     qr_code_url: str
+    qr_image_url: Optional[str] = None  # Locally rendered QR, when the provider returned the payload
     amount: int
     status: str
 
+class InvoiceJobResponse(BaseModel):
+    job_id: int
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    invoice_id: Optional[str] = None
+    qr_code_url: Optional[str] = None
+    qr_image_url: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
 class QRISStatusResponse(BaseModel):
     qris_status: str
     qris_payment_customername: Optional[str] = None
     qris_payment_methodby: Optional[str] = None
 
+# Analytics Schemas
+class AmountHistogram(BaseModel):
+    bin_edges: List[float]
+    counts: List[int]
+
+class AmountDistribution(BaseModel):
+    count: int
+    total: int
+    mean: Optional[float] = None
+    min: Optional[int] = None
+    max: Optional[int] = None
+    percentiles: Dict[str, float]
+    histogram: AmountHistogram
+
+class HourlyVolume(BaseModel):
+    weekday: int  # 0 = Sunday
+    hour: int
+    count: int
+    amount: int
+
+class PaymentMethodVolume(BaseModel):
+    payment_method: str
+    count: int
+    amount: int
+
+class TransactionAnalyticsResponse(BaseModel):
+    merchant_id: int
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    amounts: AmountDistribution
+    hourly_heatmap: List[HourlyVolume]
+    payment_methods: List[PaymentMethodVolume]
+
 # Authentication Schemas
 class Token(BaseModel):
     access_token: str
@@ -2,7 +2,7 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 import os
 import base64
 
@@ -15,16 +15,28 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # API Key encryption
-ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", "your-encryption-key-change-in-production")
-# Ensure the key is 32 bytes for Fernet
-if len(ENCRYPTION_KEY) < 32:
-    ENCRYPTION_KEY = ENCRYPTION_KEY.ljust(32, '0')
-elif len(ENCRYPTION_KEY) > 32:
-    ENCRYPTION_KEY = ENCRYPTION_KEY[:32]
+# ENCRYPTION_KEYS is a comma-separated list; the first key is the primary used
+# for encryption, the rest are only used to decrypt values written before a
+# rotation. ENCRYPTION_KEY is kept as the single-key fallback.
+ENCRYPTION_KEYS = [
+    key.strip()
+    for key in os.getenv("ENCRYPTION_KEYS", os.getenv("ENCRYPTION_KEY", "your-encryption-key-change-in-production")).split(",")
+    if key.strip()
+]
 
-# Convert to base64 for Fernet
-fernet_key = base64.urlsafe_b64encode(ENCRYPTION_KEY.encode())
-cipher_suite = Fernet(fernet_key)
+def _build_fernet(raw_key: str) -> Fernet:
+    """Build a Fernet cipher from a raw key, padded or truncated to 32 bytes."""
+    # Ensure the key is 32 bytes for Fernet
+    if len(raw_key) < 32:
+        raw_key = raw_key.ljust(32, '0')
+    elif len(raw_key) > 32:
+        raw_key = raw_key[:32]
+
+    # Convert to base64 for Fernet
+    return Fernet(base64.urlsafe_b64encode(raw_key.encode()))
+
+primary_cipher = _build_fernet(ENCRYPTION_KEYS[0])
+cipher_suite = MultiFernet([primary_cipher] + [_build_fernet(key) for key in ENCRYPTION_KEYS[1:]])
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
@@ -61,3 +73,15 @@ def encrypt_api_key(api_key: str) -> str:
 def decrypt_api_key(encrypted_api_key: str) -> str:
     """Decrypt an API key for use."""
     return cipher_suite.decrypt(encrypted_api_key.encode()).decode()
+
+def is_encrypted_with_primary_key(encrypted_api_key: str) -> bool:
+    """Check whether an encrypted API key was written with the primary key."""
+    try:
+        primary_cipher.decrypt(encrypted_api_key.encode())
+        return True
+    except InvalidToken:
+        return False
+
+def rotate_api_key(encrypted_api_key: str) -> str:
+    """Re-encrypt an encrypted API key with the primary key."""
+    return cipher_suite.rotate(encrypted_api_key.encode()).decode()
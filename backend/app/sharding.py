@@ -0,0 +1,442 @@
+"""
+Merchant-sharded storage for QRIS transactions.
+
+With TRANSACTION_SHARD_URLS set, each merchant's qris_transactions rows live on
+one of several databases. A merchant is placed on a consistent-hash ring of
+shard names the first time it is routed, and the placement is pinned in
+merchants.shard, so adding a shard leaves existing merchants where they are
+until they are moved with the rebalance command. Merchants, invoice jobs and
+the global invoice_index (invoice_id -> merchant, which also hands out
+transaction ids so they stay unique across shards) stay on DATABASE_URL.
+
+Without TRANSACTION_SHARD_URLS every transaction stays on DATABASE_URL.
+
+    python -m app.sharding init
+    python -m app.sharding plan
+    python -m app.sharding rebalance --merchant-id 42 --to shard1
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+from sqlalchemy import MetaData, create_engine, delete, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+
+from . import models
+from .database import SessionLocal, pool_options
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated name=url pairs, e.g. "shard0=postgresql://...,shard1=postgresql://..."
+TRANSACTION_SHARD_URLS = os.getenv("TRANSACTION_SHARD_URLS", "")
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "128"))
+SHARD_MAP_CACHE_SECONDS = float(os.getenv("SHARD_MAP_CACHE_SECONDS", "5"))
+
+# Rows updated this long before a rebalance started are copied again in its
+# catch-up pass, which covers clock differences between app hosts and shards
+REBALANCE_CLOCK_MARGIN = timedelta(minutes=1)
+
+def parse_shard_urls(value: str) -> Dict[str, str]:
+    """Parse "name=url,name=url" into {name: url}."""
+    shards = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, separator, url = item.partition("=")
+        if not separator or not name.strip() or not url.strip():
+            raise ValueError(f"Invalid shard entry {item!r}, expected name=url")
+        shards[name.strip()] = url.strip()
+    return shards
+
+class HashRing:
+    """Consistent-hash ring of shard names with virtual nodes."""
+
+    def __init__(self, names: List[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        self._points = sorted(
+            (self._hash(f"{name}#{index}"), name)
+            for name in names
+            for index in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in self._points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def shard_for(self, key) -> str:
+        """Shard owning a key: the first ring point clockwise from its hash."""
+        if not self._points:
+            raise ValueError("No shards configured")
+        index = bisect.bisect(self._hashes, self._hash(str(key))) % len(self._hashes)
+        return self._points[index][1]
+
+shard_urls = parse_shard_urls(TRANSACTION_SHARD_URLS)
+SHARDING_ENABLED = bool(shard_urls)
+
+shard_engines = {name: create_engine(url, pool_pre_ping=True, **pool_options(url)) for name, url in shard_urls.items()}
+shard_sessions = {
+    name: sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+    for name, shard_engine in shard_engines.items()
+}
+ring = HashRing(list(shard_urls))
+
+def _shard_metadata() -> MetaData:
+    """qris_transactions without foreign keys, as created on the shards (merchants aren't there)."""
+    metadata = MetaData()
+    table = models.QRISTransaction.__table__.to_metadata(metadata)
+    for constraint in list(table.foreign_key_constraints):
+        table.constraints.discard(constraint)
+    table.foreign_keys.clear()
+    for column in table.columns:
+        column.foreign_keys.clear()
+    return metadata
+
+shard_metadata = _shard_metadata()
+shard_table = shard_metadata.tables[models.QRISTransaction.__tablename__]
+
+class ShardMap:
+    """Merchant -> shard placements, pinned in merchants.shard on the primary and cached briefly per process."""
+
+    def __init__(self, hash_ring: HashRing, ttl: float):
+        self.ring = hash_ring
+        self.ttl = ttl
+        self._cache: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, merchant_id: int, use_cache: bool = True) -> str:
+        """Shard holding a merchant's transactions, pinning new merchants to their ring shard."""
+        now = time.monotonic()
+        if use_cache:
+            with self._lock:
+                entry = self._cache.get(merchant_id)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+
+        shard = self._load(merchant_id)
+
+        with self._lock:
+            self._cache[merchant_id] = (shard, now + self.ttl)
+            # Drop expired placements so the dict stays small
+            if len(self._cache) > 10000:
+                self._cache = {key: entry for key, entry in self._cache.items() if entry[1] > now}
+        return shard
+
+    def _load(self, merchant_id: int) -> str:
+        # Always the primary: a lagging replica could still show the shard a
+        # merchant was moved away from, after the rebalance has deleted its rows
+        db = SessionLocal()
+        try:
+            shard = db.query(models.Merchant.shard).filter(models.Merchant.id == merchant_id).scalar()
+            if shard is not None:
+                return shard
+
+            shard = self.ring.shard_for(merchant_id)
+            db.query(models.Merchant)\
+                .filter(models.Merchant.id == merchant_id, models.Merchant.shard.is_(None))\
+                .update({"shard": shard}, synchronize_session=False)
+            db.commit()
+            # Another process may have pinned it first
+            return db.query(models.Merchant.shard).filter(models.Merchant.id == merchant_id).scalar() or shard
+        finally:
+            db.close()
+
+    def forget(self, merchant_id: int):
+        with self._lock:
+            self._cache.pop(merchant_id, None)
+
+shard_map = ShardMap(ring, SHARD_MAP_CACHE_SECONDS)
+
+def _open_shard_session(name: str) -> Session:
+    if name not in shard_sessions:
+        raise RuntimeError(f"Shard {name!r} is not configured in TRANSACTION_SHARD_URLS")
+    return shard_sessions[name]()
+
+@contextmanager
+def merchant_transaction_session(db: Session, merchant_id: int) -> Iterator[Session]:
+    """Session on the database holding a merchant's transactions (`db` itself when not sharded)."""
+    if not SHARDING_ENABLED:
+        yield db
+        return
+
+    session = _open_shard_session(shard_map.get(merchant_id))
+    try:
+        yield session
+    finally:
+        session.close()
+
+def iter_transaction_sessions(db: Session) -> Iterator[Session]:
+    """Yield a session per shard (only `db` when not sharded), closing each after use."""
+    if not SHARDING_ENABLED:
+        yield db
+        return
+
+    for name in shard_sessions:
+        session = _open_shard_session(name)
+        try:
+            yield session
+        finally:
+            session.close()
+
+def merchant_for_transaction_id(db: Session, transaction_id: int) -> Optional[int]:
+    """Owner of a transaction id, from the global invoice index."""
+    return db.query(models.InvoiceIndex.merchant_id)\
+        .filter(models.InvoiceIndex.id == transaction_id)\
+        .scalar()
+
+def merchant_for_invoice_id(db: Session, invoice_id: str) -> Optional[int]:
+    """Owner of an invoice, from the global invoice index."""
+    return db.query(models.InvoiceIndex.merchant_id)\
+        .filter(models.InvoiceIndex.invoice_id == invoice_id)\
+        .scalar()
+
+def allocate_transaction_id(db: Session, invoice_id: str, merchant_id: int) -> Optional[int]:
+    """
+    Register an invoice in the global index and get the id its transaction row uses.
+
+    The index entry is committed before the row is written to its shard, so a
+    lookup never misses an existing transaction; an entry left behind by a
+    failed shard write is reused when the invoice is stored again.
+
+    Returns:
+        The transaction id, or None when not sharded (the table's own sequence is used)
+    """
+    if not SHARDING_ENABLED:
+        return None
+
+    existing = db.query(models.InvoiceIndex.id).filter(models.InvoiceIndex.invoice_id == invoice_id).scalar()
+    if existing is not None:
+        return existing
+
+    entry = models.InvoiceIndex(invoice_id=invoice_id, merchant_id=merchant_id)
+    db.add(entry)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return db.query(models.InvoiceIndex.id).filter(models.InvoiceIndex.invoice_id == invoice_id).scalar()
+    return entry.id
+
+def init_shards():
+    """Create the transactions table on every shard."""
+    for shard_engine in shard_engines.values():
+        shard_metadata.create_all(bind=shard_engine)
+
+def _insert_dialect(db: Session):
+    return postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+
+def _copy_rows(
+    source: Session,
+    target: Session,
+    merchant_id: int,
+    since: Optional[datetime] = None,
+    batch_size: int = 1000
+) -> int:
+    """
+    Upsert a merchant's rows from one shard into another in id order.
+
+    A row already on the target is only overwritten by a version that is at
+    least as new, so replaying a batch never undoes a later write.
+    """
+    copied = 0
+    last_id = 0
+    insert = _insert_dialect(target).insert
+
+    while True:
+        query = select(shard_table).where(
+            shard_table.c.merchant_id == merchant_id,
+            shard_table.c.id > last_id
+        )
+        if since is not None:
+            query = query.where(shard_table.c.updated_at >= since)
+        rows = [dict(row) for row in source.execute(query.order_by(shard_table.c.id).limit(batch_size)).mappings()]
+        source.commit()
+        if not rows:
+            return copied
+
+        stmt = insert(shard_table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={column.name: stmt.excluded[column.name] for column in shard_table.columns if column.name != "id"},
+            where=shard_table.c.updated_at <= stmt.excluded.updated_at
+        )
+        target.execute(stmt)
+        target.commit()
+
+        copied += len(rows)
+        last_id = rows[-1]["id"]
+
+def _delete_rows(db: Session, merchant_id: int, batch_size: int = 1000) -> int:
+    deleted = 0
+    while True:
+        ids = db.execute(
+            select(shard_table.c.id).where(shard_table.c.merchant_id == merchant_id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        deleted += db.execute(delete(shard_table).where(shard_table.c.id.in_(ids))).rowcount
+        db.commit()
+
+def rebalance_merchant(
+    merchant_id: int,
+    target: str,
+    batch_size: int = 1000,
+    settle_seconds: Optional[float] = None
+) -> Dict:
+    """
+    Move a merchant's transactions to another shard while it keeps serving traffic.
+
+    1. Copy every row to the target while the source stays authoritative.
+    2. Point merchants.shard at the target.
+    3. Wait until every process's cached placement has expired (placements
+       are always read from the primary, so replica lag doesn't add to this).
+    4. Copy rows changed since step 1 started, which includes writes that
+       reached the source through a stale placement.
+    5. Check the merchant is still routed to the target, then delete its
+       rows from the source.
+
+    Returns:
+        Summary with the source shard and copied/caught-up/deleted row counts
+    """
+    if target not in shard_sessions:
+        raise ValueError(f"Unknown shard {target!r}")
+    settle_seconds = 2 * SHARD_MAP_CACHE_SECONDS if settle_seconds is None else settle_seconds
+
+    db = SessionLocal()
+    try:
+        if db.query(models.Merchant.id).filter(models.Merchant.id == merchant_id).scalar() is None:
+            raise ValueError(f"Merchant {merchant_id} not found")
+        source = shard_map.get(merchant_id, use_cache=False)
+        summary = {"merchant_id": merchant_id, "source": source, "target": target, "moved": False}
+        if source == target:
+            return summary
+
+        source_db = _open_shard_session(source)
+        target_db = _open_shard_session(target)
+        try:
+            started = datetime.now(timezone.utc) - REBALANCE_CLOCK_MARGIN
+            summary["copied"] = _copy_rows(source_db, target_db, merchant_id, batch_size=batch_size)
+
+            db.query(models.Merchant)\
+                .filter(models.Merchant.id == merchant_id, models.Merchant.shard == source)\
+                .update({"shard": target}, synchronize_session=False)
+            db.commit()
+            shard_map.forget(merchant_id)
+            logger.info(f"Merchant {merchant_id} now routed to {target}, settling for {settle_seconds}s")
+            time.sleep(settle_seconds)
+
+            summary["caught_up"] = _copy_rows(source_db, target_db, merchant_id, since=started, batch_size=batch_size)
+            db.expire_all()
+            placement = db.query(models.Merchant.shard).filter(models.Merchant.id == merchant_id).scalar()
+            if placement != target:
+                # Moved again by someone else meanwhile; the source may be authoritative again
+                raise RuntimeError(
+                    f"Merchant {merchant_id} is routed to {placement!r} instead of {target!r}; "
+                    f"left its rows on {source}"
+                )
+            summary["deleted"] = _delete_rows(source_db, merchant_id, batch_size=batch_size)
+            summary["moved"] = True
+            return summary
+        finally:
+            source_db.close()
+            target_db.close()
+    finally:
+        db.close()
+
+def plan_rebalance(db: Session) -> Iterator[Dict]:
+    """Yield pinned merchants whose shard differs from their ring placement."""
+    rows = db.query(models.Merchant.id, models.Merchant.shard)\
+        .filter(models.Merchant.shard.isnot(None))\
+        .order_by(models.Merchant.id)\
+        .yield_per(1000)
+    for merchant_id, shard in rows:
+        placement = ring.shard_for(merchant_id)
+        if placement != shard:
+            yield {"merchant_id": merchant_id, "shard": shard, "ring_shard": placement}
+
+def backfill_index(shard: str, batch_size: int = 1000) -> int:
+    """
+    Add a shard's existing transactions to the invoice index.
+
+    Used once when turning sharding on for a database that already has
+    transactions (pin its merchants to that shard first).
+    """
+    db = SessionLocal()
+    shard_db = _open_shard_session(shard)
+    insert = _insert_dialect(db).insert
+    added = 0
+    last_id = 0
+    try:
+        while True:
+            rows = [
+                dict(row) for row in shard_db.execute(
+                    select(shard_table.c.id, shard_table.c.invoice_id, shard_table.c.merchant_id)
+                    .where(shard_table.c.id > last_id)
+                    .order_by(shard_table.c.id)
+                    .limit(batch_size)
+                ).mappings()
+            ]
+            shard_db.commit()
+            if not rows:
+                break
+            db.execute(insert(models.InvoiceIndex.__table__).values(rows).on_conflict_do_nothing())
+            db.commit()
+            added += len(rows)
+            last_id = rows[-1]["id"]
+
+        if db.get_bind().dialect.name == "postgresql":
+            # Explicit ids don't advance the sequence; new ids must start above them
+            db.execute(text(
+                "SELECT setval(pg_get_serial_sequence('invoice_index', 'id'), "
+                "(SELECT COALESCE(MAX(id), 0) + 1 FROM invoice_index), false)"
+            ))
+            db.commit()
+        return added
+    finally:
+        shard_db.close()
+        db.close()
+
+def main():
+    """Command line entry point for shard management."""
+    parser = argparse.ArgumentParser(description="Manage merchant-sharded transaction storage")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("init", help="Create the transactions table on every shard")
+    commands.add_parser("plan", help="List merchants whose shard differs from the hash ring")
+    rebalance = commands.add_parser("rebalance", help="Move a merchant to another shard")
+    rebalance.add_argument("--merchant-id", type=int, required=True)
+    rebalance.add_argument("--to", required=True, dest="target")
+    rebalance.add_argument("--batch-size", type=int, default=1000)
+    rebalance.add_argument("--settle-seconds", type=float, default=None)
+    backfill = commands.add_parser("backfill-index", help="Index a shard's existing transactions")
+    backfill.add_argument("--shard", required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not SHARDING_ENABLED:
+        parser.error("TRANSACTION_SHARD_URLS is not set")
+
+    if args.command == "init":
+        init_shards()
+    elif args.command == "plan":
+        db = SessionLocal()
+        try:
+            for entry in plan_rebalance(db):
+                print(json.dumps(entry))
+        finally:
+            db.close()
+    elif args.command == "rebalance":
+        print(json.dumps(rebalance_merchant(args.merchant_id, args.target, args.batch_size, args.settle_seconds)))
+    else:
+        print(json.dumps({"shard": args.shard, "indexed": backfill_index(args.shard)}))
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import os
 import logging
 
-from app.database import engine
+from app.database import engine, read_your_writes_middleware
 from app import models
-from app.routers import merchants, qris
+from app.routers import merchants, qris, admin
+from app.rate_limit import rate_limiter
+from app.invoice_expiry import start_sweeper
+from app.invoice_worker import start_workers
+from app.bulk_import import shutdown_encryption_pool
+from app.compression import CompressionMiddleware
+from app.profiling import profiling_middleware
+from app.sharding import init_shards
+from app.readiness import readiness_report
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +22,8 @@ logger = logging.getLogger(__name__)
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+# Transactions table on each shard (no-op without TRANSACTION_SHARD_URLS)
+init_shards()
 
 # Create FastAPI app
 app = FastAPI(
@@ -37,11 +47,52 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Last-Write"],
 )
 
+# Compress large JSON responses with br/gzip as negotiated by Accept-Encoding
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+)
+
+@app.on_event("startup")
+def start_invoice_expiry_sweeper():
+    """Start the background sweeper that expires stale pending invoices."""
+    app.state.invoice_sweeper_stop = start_sweeper()
+
+@app.on_event("shutdown")
+def stop_invoice_expiry_sweeper():
+    """Stop the invoice expiry sweeper."""
+    if app.state.invoice_sweeper_stop is not None:
+        app.state.invoice_sweeper_stop.set()
+
+@app.on_event("startup")
+def start_invoice_workers():
+    """Start in-process invoice workers (INVOICE_WORKERS, 0 disables them)."""
+    app.state.invoice_workers_stop = start_workers()
+
+@app.on_event("shutdown")
+def stop_invoice_workers():
+    """Stop the in-process invoice workers."""
+    if app.state.invoice_workers_stop is not None:
+        app.state.invoice_workers_stop.set()
+
+@app.on_event("shutdown")
+def stop_bulk_import_pool():
+    """Stop the bulk import encryption processes."""
+    shutdown_encryption_pool()
+
 # Include routers
 app.include_router(merchants.router)
 app.include_router(qris.router)
+app.include_router(admin.router)
+
+# Opt-in per-request profiling (X-Profile-Request header or sampling)
+app.middleware("http")(profiling_middleware)
+
+# Tell clients when they wrote so their next reads skip the replica
+app.middleware("http")(read_your_writes_middleware)
 
 @app.get("/")
 async def root():
@@ -59,6 +110,19 @@ async def health_check():
     logger.info("Health check endpoint called")
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """Readiness probe: 503 while DB pools, the QRIS upstream or the concurrency limit are saturated."""
+    report = readiness_report()
+    if not report["ready"]:
+        response.status_code = 503
+    return report
+
+@app.get("/rate-limit/stats")
+async def rate_limit_stats():
+    """Rate limiter configuration and counters."""
+    return rate_limiter.stats()
+
 @app.middleware("http")
 async def log_requests(request, call_next):
     """Log all incoming requests for debugging."""
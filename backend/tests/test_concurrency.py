@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import httpx
+from anyio import to_thread
+from fastapi import Depends, FastAPI
+
+from app.concurrency import AdaptiveConcurrencyLimiter, record_upstream_call
+
+
+def _app(limiter: AdaptiveConcurrencyLimiter, entered: threading.Event, release: threading.Event) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/upstream", dependencies=[Depends(limiter.admit)])
+    def upstream():
+        entered.set()
+        release.wait(5)
+        record_upstream_call(0.05, True)
+        return {"ok": True}
+
+    return app
+
+
+def test_rejects_with_503_while_threadpool_is_full():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1)
+    entered = threading.Event()
+    release = threading.Event()
+    app = _app(limiter, entered, release)
+
+    async def scenario():
+        # A single thread, taken by the first request's endpoint
+        to_thread.current_default_thread_limiter().total_tokens = 1
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.create_task(client.get("/upstream"))
+            while not entered.is_set():
+                await asyncio.sleep(0.01)
+
+            # Admission runs on the event loop, so this doesn't wait for a thread
+            second = await asyncio.wait_for(client.get("/upstream"), timeout=2)
+            release.set()
+            return await first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert second.status_code == 503
+    assert second.headers["Retry-After"] == "1"
+    assert first.status_code == 200
+    stats = limiter.stats()
+    assert stats["inflight"] == 0
+    assert stats["rejected"] == 1
+    assert stats["baseline_ms"] == 50.0
+
+
+def test_releases_slot_after_each_response():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1)
+    release = threading.Event()
+    release.set()
+    app = _app(limiter, threading.Event(), release)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [(await client.get("/upstream")).status_code for _ in range(3)]
+
+    assert asyncio.run(scenario()) == [200, 200, 200]
+    assert limiter.stats()["inflight"] == 0
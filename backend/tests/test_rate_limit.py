@@ -0,0 +1,51 @@
+import pytest
+from fastapi import HTTPException
+
+from app.rate_limit import Bucket, InMemoryRateLimitBackend, RateLimitBackend, RateLimiter
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        RateLimitBackend()
+
+
+def test_rejection_takes_no_tokens():
+    backend = InMemoryRateLimitBackend()
+    merchant = Bucket("merchant:1", 0.001, 2)
+    exhausted = Bucket("global", 0.001, 1)
+
+    assert backend.acquire([merchant, exhausted]) == (None, 0.0)
+    empty, retry_after = backend.acquire([merchant, exhausted])
+    assert empty == exhausted
+    assert retry_after > 0
+
+    # The merchant bucket still has its second token
+    assert backend.acquire([merchant])[0] is None
+    assert backend.acquire([merchant])[0] == merchant
+
+
+def test_prune_uses_each_buckets_own_rate():
+    backend = InMemoryRateLimitBackend(max_keys=1)
+    slow = Bucket("merchant:1", 0.001, 2)
+    fast = Bucket("global", 1e9, 2)
+
+    backend.acquire([slow])
+    backend.acquire([slow])
+    # Pruning on the fast bucket's rate would reset the drained slow bucket
+    backend.acquire([fast])
+    assert backend.acquire([slow])[0] == slow
+
+
+def test_limiter_rejects_with_429():
+    limiter = RateLimiter(InMemoryRateLimitBackend())
+    limiter.check({"merchant": "limited"}, include_global=False)
+    for _ in range(100):
+        try:
+            limiter.check({"merchant": "limited"}, include_global=False)
+        except HTTPException as exc:
+            assert exc.status_code == 429
+            assert int(exc.headers["Retry-After"]) >= 1
+            break
+    else:
+        pytest.fail("merchant bucket never ran out")
+    assert limiter.stats()["counters"]["rejected_merchant"] == 1
@@ -10,6 +10,10 @@ const API_BASE_URL = __DEV__
 class ApiService {
   constructor() {
     this.baseURL = API_BASE_URL;
+    // Last ETag and body per GET URL, reused when the server answers 304
+    this.etagCache = new Map();
+    // Time of our last write, echoed so our reads skip a lagging replica
+    this.lastWrite = null;
   }
 
   // Helper method to get auth token
@@ -45,16 +49,40 @@ class ApiService {
     };
 
     const fullUrl = `${this.baseURL}${endpoint}`;
+    const isGet = !config.method || config.method.toUpperCase() === 'GET';
+    const cached = isGet ? this.etagCache.get(fullUrl) : null;
+
+    if (cached) {
+      config.headers['If-None-Match'] = cached.etag;
+    }
+    if (this.lastWrite) {
+      config.headers['X-Last-Write'] = this.lastWrite;
+    }
 
     try {
       const response = await fetch(fullUrl, config);
       
+      const lastWrite = response.headers.get('X-Last-Write');
+      if (lastWrite) {
+        this.lastWrite = lastWrite;
+      }
+      
+      if (response.status === 304 && cached) {
+        return cached.data;
+      }
+      
       if (!response.ok) {
         const errorData = await response.json().catch(() => ({}));
         throw new Error(errorData.detail || `HTTP ${response.status}`);
       }
       
       const responseData = await response.json();
+      
+      const etag = response.headers.get('ETag');
+      if (isGet && etag) {
+        this.etagCache.set(fullUrl, { etag, data: responseData });
+      }
+      
       return responseData;
     } catch (error) {
       throw error;